@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+"""
+This script measures the speed of the feature extraction of generate_data.py,
+offline, on a synthetic corpus generated deterministically (same --seed and
+--pages, same corpus): benign-like pages, pages with XSS (scripts, event
+handlers, javascript: URIs), pages with a huge minified script and pages with
+a deeply nested DOM.
+It runs micro-benchmarks of the parsing functions, and an end-to-end
+benchmark of generate_data.main (pages per second). Results are written as
+JSON, to be compared with the ones of another run with --compare.
+
+Example:
+python3 benchmark.py --json before.json
+(change the code)
+python3 benchmark.py --json after.json --compare before.json
+"""
+
+import argparse, json, os, platform, random, sys, time
+from contextlib import redirect_stdout
+from hashlib import sha1
+import generate_data
+from generate_data import (EVENTHANDLERSATTRS, JS_DOM_OBJECTS,
+    JS_PROPERTIES, JS_METHODS, PARSERS, parse_url, parse_html,
+    parse_javascript, html_elements, extractor_version)
+
+WORDS = ['home', 'news', 'search', 'login', 'contact', 'about', 'products',
+    'blog', 'help', 'the', 'and', 'page', 'welcome', 'price', 'user', 'video',
+    'photo', 'hack', 'free', 'download', 'account', 'privacy', 'terms']
+PAYLOADS = ['<script>alert(1)</script>', '<script>alert(document.cookie)'
+    '</script>', '<img src=x onerror=alert(1)>', '<svg onload=prompt(1)>',
+    '<iframe src="javascript:alert(String.fromCharCode(88,83,83))">',
+    '"><script>document.write(document.referrer)</script>',
+    '<body onload=eval(location.hash.slice(1))>',
+    '<a href="javascript:confirm(document.domain)">x</a>']
+# proportion of each kind of page in the corpus
+KINDS = [('benign', 0.55), ('xss', 0.3), ('minified', 0.05), ('nested', 0.1)]
+
+def text(rng, number_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(number_words))
+
+def script(rng):
+    """
+    Returns a small JS code, as found in benign pages
+    """
+    name = rng.choice(WORDS) + str(rng.randrange(1000))
+    return rng.choice([
+        'function {0}(a, b) {{ return a + b * {1}; }}',
+        'var {0} = document.getElementById("{0}"); {0}.style.display = '
+            '"none";',
+        '(function() {{ var s = "{0}"; window.{0} = s.length + {1}; }})();',
+        'document.write("<p>{0} {1}</p>");',
+    ]).format(name, rng.randrange(100))
+
+def minified_script(rng, size):
+    """
+    Returns a minified-like JS code of about size characters
+    """
+    parts = []
+    length = 0
+    while length < size:
+        a, b, c = (rng.choice('abcdefghijklmnopqrstuvwxyz') +
+            str(rng.randrange(100)) for _ in range(3))
+        part = rng.choice([
+            'var {0}=function({1},{2}){{return {1}+{2}*{3}}};',
+            '{0}.{1}=({2}||[]).concat("{0}{3}");',
+            'if({0}>{3}){{{1}({2},"{3}")}}else{{{2}={0}?{1}:{3}}}',
+            'for(var {0}=0;{0}<{3};{0}++){{{1}[{0}]={2}({0})}}',
+        ]).format(a, b, c, rng.randrange(1000))
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def page(rng, kind):
+    """
+    Returns the (url, html) of a synthetic page of kind (see KINDS)
+    """
+    domain = 'http://{0}{1}.com/'.format(rng.choice(WORDS),
+        rng.randrange(1000))
+    url = domain + '{0}?q={1}'.format(rng.choice(WORDS), rng.choice(WORDS))
+    body = ['<p>{0}</p>'.format(text(rng, rng.randrange(10, 60)))
+        for _ in range(rng.randrange(5, 30))]
+    body += ['<a href="{0}{1}">{1}</a>'.format(domain, rng.choice(WORDS))
+        for _ in range(rng.randrange(5, 30))]
+    head = ['<script>{0}</script>'.format(script(rng))
+        for _ in range(rng.randrange(0, 4))]
+    head.append('<link href="{0}style.css" rel="stylesheet">'.format(domain))
+    if kind == 'xss':
+        payload = rng.choice(PAYLOADS)
+        url = domain + 'search?q=' + payload
+        for _ in range(rng.randrange(1, 4)):
+            body.insert(rng.randrange(len(body)), payload)
+        body.append('<div {0}="alert({1})">{2}</div>'.format(
+            rng.choice(EVENTHANDLERSATTRS), rng.randrange(100),
+            text(rng, 5)))
+    elif kind == 'minified':
+        head.append('<script>{0}</script>'.format(minified_script(rng,
+            rng.randrange(100000, 300000))))
+    elif kind == 'nested':
+        depth = rng.randrange(500, 1500)
+        body.append('<div>' * depth + text(rng, 5) + '</div>' * depth)
+        body.append('<script>{0}</script>'.format('(' * 200 + '1' +
+            ')' * 200))
+    html = ('<html><head><title>{0}</title>{1}</head><body>{2}</body>'
+        '</html>').format(text(rng, 4), ''.join(head), '\n'.join(body))
+    return url, html
+
+def pages(number_pages, seed):
+    """
+    Generator of the (kind, url, html) of number_pages synthetic pages
+    """
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in KINDS]
+    weights = [weight for _, weight in KINDS]
+    for _ in range(number_pages):
+        kind = rng.choices(kinds, weights)[0]
+        url, html = page(rng, kind)
+        yield kind, url, html
+
+def generate_corpus(path, number_pages = 400, seed = 0):
+    """
+    Writes a synthetic corpus in path, organised as the corpus of the
+    spiders (HTML files and feeds), to run generate_data.py on it. Benign
+    pages go to the randomwalk feed, the others to the xssed feed.
+    Returns the number of pages of each kind.
+    """
+    os.makedirs(os.path.join(path, 'html/randomsample/subsample'),
+        exist_ok=True)
+    os.makedirs(os.path.join(path, 'html/xssed/full'), exist_ok=True)
+    randomwalk, xssed = [], []
+    kinds = {}
+    for kind, url, html in pages(number_pages, seed):
+        kinds[kind] = kinds.get(kind, 0) + 1
+        name = sha1(url.encode() + html.encode()).hexdigest()
+        if kind == 'benign':
+            # the spider's path, mapped to the subsample by generate_data.py
+            randomwalk.append({'url': url,
+                'file_path': 'html/randomsample/full/' + name})
+            file_path = 'html/randomsample/subsample/' + name
+        else:
+            file_path = 'html/xssed/full/' + name
+            xssed.append({'url': url, 'category': 'XSS',
+                'files': [{'path': 'full/' + name}]})
+        with open(os.path.join(path, file_path), 'w') as f:
+            f.write(html)
+    for filename, feed in (('randomwalk.json', randomwalk),
+            ('xssed.json', xssed)):
+        with open(os.path.join(path, filename), 'w') as f:
+            json.dump(feed, f)
+    return kinds
+
+def measure(function, inputs, repeat):
+    """
+    Returns the best time of repeat calls of function on all the inputs,
+    divided by the number of inputs
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in inputs:
+            function(i)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(inputs), 1)
+
+def micro_benchmarks(number_pages, seed, repeat):
+    """
+    Returns a dict of the time per call (in seconds) of the parsing functions,
+    by kind of page
+    """
+    corpus = list(pages(number_pages, seed))
+    by_kind = {}
+    for kind, url, html in corpus:
+        by_kind.setdefault(kind, []).append(html)
+    urls = [url for _, url, _ in corpus]
+    scripts = [script(random.Random(i)) for i in range(200)]
+    minified = [minified_script(random.Random(i), 100000) for i in range(3)]
+    js = lambda code: parse_javascript(code, JS_DOM_OBJECTS, JS_PROPERTIES,
+        JS_METHODS)
+    benchmarks = {'parse_url': (parse_url, urls),
+        'parse_javascript[small]': (js, scripts),
+        'parse_javascript[minified]': (js, minified)}
+    for kind, htmls in sorted(by_kind.items()):
+        benchmarks['parse_html[{0}]'.format(kind)] = (parse_html, htmls)
+    for parser in PARSERS:
+        benchmarks['html_elements[{0}]'.format(parser)] = (
+            lambda html, parser=parser: list(html_elements(html, parser)),
+            by_kind.get('benign', []))
+    results = {}
+    for name, (function, inputs) in benchmarks.items():
+        seconds = measure(function, inputs, repeat)
+        results[name] = {'seconds_per_call': seconds, 'calls': len(inputs)}
+        print('{0:>32} {1:10.3f} ms'.format(name, seconds * 1e3))
+    return results
+
+def end_to_end(path, workers, parser, repeat, expected_pages):
+    """
+    Returns the best time and the pages per second of generate_data.main on
+    the corpus at path (without feature cache, and with an empty JS cache at
+    each run), which must output the features of its expected_pages pages
+    """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        best = float('inf')
+        for _ in range(repeat):
+            # the in-memory JS cache of this process would stay warm between
+            # the runs (the pool processes of --workers start with an empty
+            # one)
+            generate_data.open_js_cache.cache_clear()
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                generate_data.main(['--no-cache', '--output', 'data.csv',
+                    '--workers', str(workers), '--parser', parser])
+            best = min(best, time.perf_counter() - start)
+        with open('data.csv') as f:
+            number_pages = sum(1 for _ in f) - 1
+    finally:
+        os.chdir(cwd)
+    assert number_pages == expected_pages, ('{0} pages processed out of '
+        '{1}'.format(number_pages, expected_pages))
+    return {'pages': number_pages, 'seconds': best,
+        'pages_per_second': number_pages / best}
+
+def compare(results, reference, tolerance):
+    """
+    Prints the speed of results relative to reference (results of a previous
+    run), and returns the list of the benchmarks slower by more than
+    tolerance
+    """
+    regressions = []
+    rows = []
+    for name, result in results['micro'].items():
+        if name in reference['micro']:
+            rows.append((name, reference['micro'][name]['seconds_per_call'] /
+                result['seconds_per_call']))
+    for name, result in results['end_to_end'].items():
+        if name in reference['end_to_end']:
+            rows.append(('end_to_end[{0}]'.format(name),
+                result['pages_per_second'] /
+                reference['end_to_end'][name]['pages_per_second']))
+    for name, speedup in rows:
+        regression = speedup < 1 - tolerance
+        if regression:
+            regressions.append(name)
+        print('{0:>32} {1:6.2f}x{2}'.format(name, speedup,
+            '  REGRESSION' if regression else ''))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the feature '
+        'extraction of generate_data.py on a synthetic corpus')
+    parser.add_argument('--corpus', default='benchmark_corpus',
+        help='folder of the synthetic corpus (default: benchmark_corpus)')
+    parser.add_argument('--pages', type=int, default=400,
+        help='number of pages of the corpus (default: 400)')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the corpus generator (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='number of runs of each benchmark, the best one is kept '
+        '(default: 3)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+        help='numbers of processes of the end-to-end benchmark (default: 1)')
+    parser.add_argument('--parser', choices=PARSERS, default='html5lib',
+        help='HTML parser backend of the end-to-end benchmark (default: '
+        'html5lib)')
+    parser.add_argument('--skip-micro', action='store_true',
+        help='only run the end-to-end benchmark')
+    parser.add_argument('--skip-end-to-end', action='store_true',
+        help='only run the micro-benchmarks')
+    parser.add_argument('--json', default=None,
+        help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+        help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='slowdown above which a benchmark is reported as a regression, '
+        'with --compare (default: 0.1)')
+    args = parser.parse_args()
+    # the parsing messages are not useful here
+    generate_data.logger.disabled = True
+    results = {'meta': {'python': platform.python_version(),
+        'platform': platform.platform(), 'date': time.strftime('%Y-%m-%d '
+        '%H:%M:%S'), 'extractor_version': extractor_version(),
+        'pages': args.pages, 'seed': args.seed, 'parser': args.parser},
+        'micro': {}, 'end_to_end': {}}
+    if not args.skip_micro:
+        print('Micro-benchmarks (time per call):')
+        results['micro'] = micro_benchmarks(args.pages, args.seed,
+            args.repeat)
+    if not args.skip_end_to_end:
+        kinds = generate_corpus(args.corpus, args.pages, args.seed)
+        print('End-to-end on {0} pages ({1}):'.format(args.pages, ', '.join(
+            '{0} {1}'.format(number, kind) for kind, number in
+            sorted(kinds.items()))))
+        for workers in args.workers:
+            result = end_to_end(args.corpus, workers, args.parser,
+                args.repeat, sum(kinds.values()))
+            results['end_to_end']['workers={0}'.format(workers)] = result
+            print('{0:>32} {1:10.1f} pages/s'.format(
+                'workers={0}'.format(workers), result['pages_per_second']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        print('Speedup relative to {0}:'.format(args.compare))
+        if compare(results, reference, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+This script runs two HTML parser backends of generate_data.py over a corpus
+of HTML files and reports, for each feature, the rate of files on which the
+two backends disagree. It helps to choose the fastest backend whose features
+are close enough to the ones of html5lib (the reference).
+
+Example:
+python3 compare_parsers.py --parsers html5lib stream --limit 2000 > parity.txt
+"""
+
+import argparse, json, time, logging
+from os import path
+from multiprocessing import Pool
+from generate_data import PARSERS, parse_html_file, list_pages, logger
+
+def list_files(paths):
+    """
+    Input a list of files or folders (or PageStores), outputs the sorted list
+    of the files (folders are not browsed recursively)
+    """
+    files = []
+    for p in paths:
+        if path.isdir(p):
+            files += sorted(path.join(p, i) for i in list_pages(p))
+        else:
+            files.append(p)
+    return files
+
+def compare_file(task):
+    """
+    Input a (filename, parsers) tuple, outputs a tuple of the features of
+    filename computed by each parser and the parsing time of each parser
+    """
+    filename, parsers = task
+    features = []
+    durations = []
+    for parser in parsers:
+        start = time.perf_counter()
+        features.append(parse_html_file(filename, parser = parser))
+        durations.append(time.perf_counter() - start)
+    return features, durations
+
+def compare(files, parsers, workers = 1):
+    """
+    Parses files with the 2 parsers and returns a dict containing the
+    per-feature disagreement rates and the total parsing time of each parser
+    """
+    disagreements = {}
+    number_files = 0
+    number_files_different = 0
+    durations = [0., 0.]
+    tasks = ((filename, parsers) for filename in files)
+    if workers <= 1:
+        results = map(compare_file, tasks)
+    else:
+        pool = Pool(workers)
+        results = pool.imap(compare_file, tasks, 8)
+    for (features_a, features_b), (duration_a, duration_b) in results:
+        if features_a is None or features_b is None: # file not found
+            continue
+        number_files += 1
+        durations[0] += duration_a
+        durations[1] += duration_b
+        different = False
+        for feature in features_a:
+            disagreements.setdefault(feature, 0)
+            if features_a[feature] != features_b.get(feature):
+                disagreements[feature] += 1
+                different = True
+        number_files_different += different
+    if workers > 1:
+        pool.close()
+        pool.join()
+    rates = {feature: count / max(number_files, 1)
+        for feature, count in disagreements.items()}
+    return {
+        'parsers': list(parsers),
+        'number_files': number_files,
+        'rate_files_different': number_files_different / max(number_files, 1),
+        'seconds': dict(zip(parsers, durations)),
+        'disagreement_rates': dict(sorted(rates.items(),
+            key=lambda i: i[1], reverse=True)),
+    }
+
+def print_report(report):
+    a, b = report['parsers']
+    print('{0} files parsed'.format(report['number_files']))
+    for parser, seconds in report['seconds'].items():
+        print('{0}: {1:.1f}s'.format(parser, seconds))
+    print('Files with at least one different feature: {0:.2%}'.format(
+        report['rate_files_different']))
+    print('Disagreement rate per feature ({0} vs {1}):'.format(a, b))
+    for feature, rate in report['disagreement_rates'].items():
+        if rate > 0:
+            print('{0:>40} {1:.2%}'.format(feature, rate))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the features '
+        'computed by 2 HTML parser backends of generate_data.py')
+    parser.add_argument('paths', nargs='*', default=['html/xssed/full/',
+        'html/randomsample/subsample/'], help='HTML files or folders '
+        '(default: the xssed and randomsample corpora)')
+    parser.add_argument('--parsers', nargs=2, choices=PARSERS,
+        default=['html5lib', 'stream'], help='the 2 backends to compare '
+        '(default: html5lib stream)')
+    parser.add_argument('--limit', type=int, default=None,
+        help='maximum number of files to parse')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of processes (default: 1)')
+    parser.add_argument('--json', default=None,
+        help='also write the report to this JSON file')
+    args = parser.parse_args()
+    # the logs of the parsing are not useful here
+    logger.setLevel(logging.CRITICAL)
+    files = list_files(args.paths)[:args.limit]
+    report = compare(files, args.parsers, args.workers)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,47 @@
 This script parses the html files inside html/xssed/full and 
 html/randomwalk/subsample as defined respectively in xssed.json and 
 randomwalk.json. It outputs data.csv.
+Feeds are read, and rows written, as a stream: the memory used doesn't depend
+on the size of the corpus. JSON Lines feeds (scrapy -o items.jl) are supported.
+Use --workers N to parse the pages with a pool of N processes, and --parser to
+choose the HTML parser backend.
+With --format npy, the features are written as a NumPy matrix instead (see
+write_matrix), to be loaded zero-copy by load_matrix.
+The corpus can be split with --shard i/N between several processes or 
+machines. Each shard writes its rows and a checkpoint, to resume if it is
+interrupted; --merge N then builds the final output (see ShardOutput).
+Features are cached in features_cache.sqlite, indexed by the content of the
+HTML files, so that only new or modified files are parsed by the next runs.
+The pages can also be read from PageStores (see scraping/pagestore.py), with
+--randomwalk-pages and --xssed-pages.
 HTML files referenced on the json files that cannot be found will be discarted
 (because the random sample was subsampled and some duplicated or very large
 files were removed).
 
+To compute the features of new pages, e.g. to score them with a model, use 
+FeatureExtractor.
+
 TODO:
-- compile regex for performance
-- change the structure of the code for easier reuse for prediction (?)
 - count event handlers defined in JS?
 """ 
 
-import json, csv, re, esprima
+import json, csv, re, esprima, argparse, sqlite3, bs4, html5lib, locale
+import sys, threading, time, logging, cProfile, heapq, platform
+import numpy as np
 from urllib.parse import unquote as urldecode
-from bs4 import BeautifulSoup
-from os import listdir
+from bs4 import BeautifulSoup, Tag
+from os import listdir, getpid, replace, fsync, fstat, truncate
+from os.path import splitext, getsize, exists, split, join
+from io import BytesIO, TextIOWrapper
+from hashlib import sha1
+from collections import Counter, OrderedDict, deque, namedtuple
+from collections.abc import MutableMapping
+from functools import partial, lru_cache
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from multiprocessing import Pool
+from scraping.pagestore import PageStore, is_page_store
+from scraping.feeds import iter_json
 
 # tags and attributes to count: in URL and in HTML
 TAGS = ['script', 'iframe', 'meta', 'applet', 'object', 'embed', 'link', 'svg',
@@ -57,42 +84,464 @@ KEYWORDS_EVIL = ['XSS', 'evil',
     'hack', 'pwd', 'pown', 'h4ck', 'h@ck', 'anonymous', 'control by',
     'controled by', 'in control', 'under the control']
     # from me
+# JS identifiers to count: DOM objects, properties and methods
+JS_DOM_OBJECTS = ('windows', 'location', 'document')
+JS_PROPERTIES = ('cookie', 'document', 'referrer') #location
+JS_METHODS = ('write', 'getElementsByTagName', 'alert', 'eval', 'fromCharCode',
+    'prompt', 'confirm', 'fetch')
+
+# messages of the feature extraction (invalid JS, etc.). main prints them on
+# stdout
+logger = logging.getLogger('generate_data')
+logger.addHandler(logging.NullHandler())
+
+# counters of the current process (cache hits, etc.), reset and returned with
+# the features of each page by extract_page. The time spent in each stage of
+# the extraction is counted in seconds_<stage> (see timer)
+counters = Counter()
+
+@contextmanager
+def timer(stage):
+    """
+    Adds the time spent in the with block to counters['seconds_' + stage]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        counters['seconds_' + stage] += time.perf_counter() - start
+
+def feature_names(tags = TAGS, attrs = ATTRS, 
+        eventHandlersAttrs = EVENTHANDLERSATTRS, domObjects = JS_DOM_OBJECTS,
+        properties = JS_PROPERTIES, methods = JS_METHODS, degraded = False):
+    """
+    Returns the list of the columns of data.csv, in the order of the dicts 
+    returned by extract_page: the class, the features of parse_url, then the
+    ones of parse_html (including 'degraded' if parsed with a Budget)
+    """
+    names = ['class', 'url_length', 'url_duplicated_characters']
+    names += ['url_tag_' + i for i in tags]
+    names += ['url_attr_' + i for i in attrs]
+    names += ['url_event_' + i for i in eventHandlersAttrs]
+    names += ['url_cookie', 'url_redirection', 'url_number_keywords_param',
+        'url_number_keywords_evil', 'url_number_domain', 'url_number_ip']
+    names += ['html_tag_' + i for i in tags]
+    names += ['html_attr_' + i for i in attrs]
+    names += ['html_event_' + i for i in eventHandlersAttrs]
+    names += ['html_number_keywords_evil', 'js_file', 'js_pseudo_protocol']
+    names += ['js_dom_' + i for i in domObjects]
+    names += ['js_prop_' + i for i in properties]
+    names += ['js_method_' + i for i in methods]
+    names += ['js_min_length', 'js_min_define_function', 
+        'js_min_function_calls', 'js_string_max_length', 'html_length']
+    if degraded:
+        names.append('degraded')
+    return names
+
+def write_csv(data, filename, fieldnames = None):
+    """
+    Writes data, an iterable of dicts, to the CSV file filename. Rows are 
+    written as soon as they are produced by data (which can be a generator), 
+    and the file is line buffered, so rows are not lost if the process is 
+    interrupted.
+    fieldnames (default: feature_names()) is the fixed list of columns.
+    """
+    if fieldnames is None:
+        fieldnames = feature_names()
+    with open(filename, 'w', buffering=1) as f:
+        writer = csv.DictWriter(f, fieldnames, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writeheader()
+        for row in data:
+            writer.writerow(row)
+
+# type of the values of the feature matrix. float64 represents exactly the
+# booleans, counts and lengths of the features
+MATRIX_DTYPE = np.float64
 
-def import_json(filename):
-    with open(filename, 'r') as f:
-        return json.load(f)
-
-def write_csv(data, filename):
-    with open(filename, 'w') as f:
-        reader = csv.DictWriter(f, data[0].keys(), quoting=csv.QUOTE_NONNUMERIC)
-        reader.writeheader()
-        reader.writerows(data)
-
-def node_generator(node):
-    """
-    Generator that takes an Esprima object (or a Esprima node) from the esprima
-    module converted as a dict, and outputs all child nodes at any level of the 
-    tree. It's useful to browse the entire tree.
-    Subnodes are generated by browsing all the keys. It's not the most 
-    optimized way to browse the tree, because some keys will never contains 
-    child nodes. But it's very simple, and you're sure to not miss any subnodes. 
-    """
-    if node: # not empty dict or list 
-        # node is a dict
-        if isinstance(node, dict):
-            yield node
-            for key in node:
-                yield from node_generator(node[key])
-        # node is a list
-        elif isinstance(node, list):
-            for subnode in node:
-                yield from node_generator(subnode)
-
-def parse_javascript(string, domObjects, properties, methods, filename = None):
+def matrix_paths(prefix):
+    """
+    Returns the paths of the feature matrix, of the label vector and of the 
+    manifest written by write_matrix with prefix
+    """
+    return prefix + '.npy', prefix + '.labels.npy', prefix + '.columns.json'
+
+class FeatureRow(MutableMapping):
+    """
+    Dict-like view of a row of a feature matrix (a 1-D array, e.g. a row of
+    the memmap of write_matrix), indexed by the names of the features. 
+    parse_url and parse_html called with out=FeatureRow(...) write the 
+    features directly in the matrix, without intermediate dict.
+    index maps the names of the features to their column, ex:
+    {name: i for i, name in enumerate(feature_names()[1:])}
+    """
+    __slots__ = ('row', 'index')
+
+    def __init__(self, row, index):
+        self.row = row
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.row[self.index[key]]
+
+    def __setitem__(self, key, value):
+        self.row[self.index[key]] = value
+
+    def __delitem__(self, key):
+        raise TypeError('the columns of a FeatureRow are fixed')
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+def write_matrix(data, prefix, fieldnames = None, number_rows = None):
+    """
+    Writes data, an iterable of dicts, as a feature matrix:
+    - prefix.npy: the features (all the fieldnames except class), one row 
+    per dict, as MATRIX_DTYPE
+    - prefix.labels.npy: the classes, as int8
+    - prefix.columns.json: the manifest (columns, dtype and shape of the 
+    matrix, version of the extractor)
+    The matrix is preallocated as a memmap of number_rows rows (default: 
+    the length of data), filled as soon as the rows are produced by data,
+    and shrunk at the end if data produced fewer rows.
+    Returns the number of rows written.
+    """
+    if fieldnames is None:
+        fieldnames = feature_names()
+    columns = [i for i in fieldnames if i != 'class']
+    if number_rows is None:
+        data = list(data)
+        number_rows = len(data)
+    path_matrix, path_labels, path_manifest = matrix_paths(prefix)
+    matrix = np.lib.format.open_memmap(path_matrix, mode='w+', 
+        dtype=MATRIX_DTYPE, shape=(number_rows, len(columns)))
+    labels = np.zeros(number_rows, dtype=np.int8)
+    number_rows_written = 0
+    for row in data:
+        if number_rows_written == number_rows:
+            raise ValueError('more than {0} rows'.format(number_rows))
+        matrix[number_rows_written] = [row[i] for i in columns]
+        labels[number_rows_written] = row['class']
+        number_rows_written += 1
+    matrix.flush()
+    if number_rows_written < number_rows:
+        # some pages were discarded
+        np.save(path_matrix + '.tmp.npy', matrix[:number_rows_written])
+        del matrix
+        replace(path_matrix + '.tmp.npy', path_matrix)
+    else:
+        del matrix
+    np.save(path_labels, labels[:number_rows_written])
+    manifest = {
+        'columns': columns,
+        'dtype': np.dtype(MATRIX_DTYPE).name,
+        'shape': [number_rows_written, len(columns)],
+        'matrix': path_matrix,
+        'labels': path_labels,
+        'extractor_version': extractor_version(),
+    }
+    with open(path_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return number_rows_written
+
+def load_matrix(prefix, mmap_mode = 'r'):
+    """
+    Loads the feature matrix written by write_matrix with prefix, memory 
+    mapped (no copy) by default. Returns a tuple of the matrix, the labels and
+    the list of the names of the columns.
+    """
+    path_matrix, path_labels, path_manifest = matrix_paths(prefix)
+    with open(path_manifest, 'r') as f:
+        manifest = json.load(f)
+    matrix = np.load(path_matrix, mmap_mode=mmap_mode)
+    labels = np.load(path_labels, mmap_mode=mmap_mode)
+    if list(matrix.shape) != manifest['shape']:
+        raise ValueError('{0} does not match {1}'.format(path_matrix, 
+            path_manifest))
+    return matrix, labels, manifest['columns']
+
+# a < followed by the name of an opening or closing tag, see TagMatcher
+TAG_START = re.compile(r'<\s*(/\s*)?([^\s<>/]*)')
+TAG_END = re.compile(r'\s*>')
+# a name followed by =, see NameMatcher
+NAME_ASSIGNMENT = re.compile(r'([\w-]+)\s*=')
+# sources of redirection in URL, see parse_url
+REDIRECTIONS = ['window.location', 'window.history', 'window.navigate', 
+    'document.URL', 'document.documentURI', 'document.URLUnencoded', 
+    'document.baseURI', 'location', 'window.open', 'self.location', 
+    'top.location']
+REDIRECTION = re.compile('|'.join(map(re.escape, REDIRECTIONS)))
+DOMAIN = re.compile(r'(?:(?!-)[A-Za-z0-9-]{1,63}(?!-)\.)+[A-Za-z]{2,6}')
+IP = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(\.\d{1,3}\.\d{1,3})?')
+JS_PROTOCOL = re.compile(r'^\s*javascript:(.*)', 
+    flags=(re.IGNORECASE|re.DOTALL))
+
+class TagMatcher(object):
+    """
+    Finds in one scan of a string which tags are opened or closed, ignoring 
+    case and whitespaces. For each tag, it is equivalent to:
+        re.search('<\s*'+tag+'.*>|<\s*/\s*'+tag+'\s*>', string, 
+            flags=re.IGNORECASE)
+    Every < is visited once, and the name following it is compared to the
+    tags.
+    """
+    def __init__(self, tags):
+        self.tags = [(tag, tag.casefold()) for tag in tags]
+
+    def search(self, string):
+        """Returns the set of the tags found in string"""
+        found = set()
+        for match in TAG_START.finditer(string):
+            name = match.group(2).casefold()
+            if match.group(1): # closing tag: '</' name '\s*>'
+                if TAG_END.match(string, match.end()):
+                    found.update(tag for tag, folded in self.tags 
+                        if folded == name)
+            else: # opening tag: '<' name '.*>'
+                end_tag = string.find('>', match.end())
+                end_line = string.find('\n', match.end())
+                if end_tag != -1 and (end_line == -1 or end_tag < end_line):
+                    found.update(tag for tag, folded in self.tags 
+                        if name.startswith(folded))
+        return found
+
+class NameMatcher(object):
+    """
+    Finds in one scan of a string which names (of attributes or event 
+    handlers) are assigned, ignoring case. For each name, it is equivalent to:
+        re.search(name+'\s*=', string, flags=re.IGNORECASE)
+    The longest run of word characters before each = is compared to the 
+    names.
+    """
+    def __init__(self, names):
+        self.names = {}
+        for name in names:
+            self.names.setdefault(name.casefold(), []).append(name)
+        self.lengths = sorted(set(len(name) for name in self.names))
+
+    def search(self, string):
+        """Returns the set of the names found in string"""
+        found = set()
+        for match in NAME_ASSIGNMENT.finditer(string):
+            word = match.group(1).casefold()
+            for length in self.lengths:
+                if length > len(word):
+                    break
+                names = self.names.get(word[-length:])
+                if names:
+                    found.update(names)
+        return found
+
+class KeywordMatcher(object):
+    """
+    Counts in one scan of a string the occurrences of keywords (literal 
+    strings), using a single regex made of the alternation of the keywords.
+    Keywords that can overlap with themselves (ex: 'aba' in 'ababa') are
+    counted separately, to count non-overlapping occurrences like re.findall.
+    """
+    def __init__(self, keywords, ignorecase = False):
+        self.keywords = list(keywords)
+        self.flags = re.IGNORECASE if ignorecase else 0
+        fold = str.casefold if ignorecase else str
+        distinct = list(dict.fromkeys(self.keywords))
+        self.overlapping = [k for k in distinct if any(
+            fold(k[:i]) == fold(k[-i:]) for i in range(1, len(k)))]
+        keywords = sorted((k for k in distinct if k not in self.overlapping),
+            key=len, reverse=True)
+        # keywords found at the same position as a longer one, indexed by the
+        # number of the group of the regex
+        self.prefixes = [None] + [[j for j in keywords 
+            if fold(k).startswith(fold(j))] for k in keywords]
+        self.regex = None
+        if keywords:
+            # lookahead to find overlapping occurrences of different keywords.
+            # The class of the first characters speeds up the scan.
+            first = ''.join(sorted(set(re.escape(k[0]) for k in keywords)))
+            self.regex = re.compile('(?=[{0}])(?=(?:{1}))'.format(first, 
+                '|'.join('({0})'.format(re.escape(k)) for k in keywords)), 
+                self.flags)
+
+    def count(self, string):
+        """
+        Returns the list of the number of occurrences of each keyword, in the
+        order of keywords
+        """
+        counts = dict.fromkeys(self.keywords, 0)
+        if self.regex is not None:
+            for match in self.regex.finditer(string):
+                for keyword in self.prefixes[match.lastindex]:
+                    counts[keyword] += 1
+        for keyword in self.overlapping:
+            counts[keyword] = len(re.findall(re.escape(keyword), string, 
+                flags=self.flags))
+        return [counts[keyword] for keyword in self.keywords]
+
+@lru_cache(maxsize=32)
+def url_matchers(tags, names, keywords_param, keywords_evil):
+    """
+    Returns the matchers used by parse_url, built once per configuration
+    (the arguments are tuples)
+    """
+    return (TagMatcher(tags), NameMatcher(names), 
+        KeywordMatcher(keywords_param), KeywordMatcher(keywords_evil))
+
+@lru_cache(maxsize=32)
+def html_keyword_matcher(keywords):
+    """Returns the KeywordMatcher used by parse_html to count keywords"""
+    return KeywordMatcher(keywords, ignorecase=True)
+
+# build the matchers of the default configuration at import
+url_matchers(tuple(TAGS), tuple(ATTRS + EVENTHANDLERSATTRS), 
+    tuple(KEYWORDS_PARAM), tuple(KEYWORDS_EVIL))
+html_keyword_matcher(tuple(KEYWORDS_EVIL))
+
+# limits of the cost of parsing a document (see parse_html), None for no
+# limit:
+# - html_bytes: characters of HTML parsed to build the DOM
+# - seconds: wall time of parse_html
+# - script_bytes: characters of a JS code parsed by esprima
+# - script_nodes: nodes of the AST of a JS code
+# Over budget, cheaper approximate features are computed: on the truncated
+# DOM, or lexical-only for JS (see lexical_javascript).
+Budget = namedtuple('Budget', ['html_bytes', 'seconds', 'script_bytes',
+    'script_nodes'], defaults=(None, None, None, None))
+
+class BudgetExceeded(Exception):
+    pass
+
+class NodeCounter(object):
+    """
+    Delegate of esprima.parseScript that counts the nodes of the AST while it 
+    is built, instead of converting the whole tree to dicts and browsing it.
+    For the definition of the nodes, see:
+    https://github.com/estree/estree/blob/master/es5.md
+    Raises BudgetExceeded if the AST has more than max_nodes nodes, or if the
+    deadline (a time.monotonic() value) has passed.
+    """
+    def __init__(self, max_nodes = None, deadline = None):
+        self.max_nodes = max_nodes
+        self.deadline = deadline
+        self.nodes = 0
+        self.define_function = 0
+        self.function_calls = 0
+        # offsets of the calls of a function named async. esprima parses
+        # `async (x) => x` as a call, then reinterprets it as an arrow function
+        self.async_calls = set()
+
+    def __call__(self, node, metadata):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise BudgetExceeded('more than {0} nodes'.format(self.max_nodes))
+        if (self.deadline is not None and self.nodes % 256 == 0 and 
+                time.monotonic() > self.deadline):
+            raise BudgetExceeded('time budget exceeded')
+        if node.type == 'FunctionDeclaration': # Function Declaration
+            self.define_function += 1
+        elif node.type in ('CallExpression', 'FunctionExpression'): # function or method calls
+            self.function_calls += 1
+            if (node.type == 'CallExpression' and 
+                    node.callee.type == 'Identifier' and 
+                    node.callee.name == 'async'):
+                self.async_calls.add(metadata.start.offset)
+        elif (node.type == 'ArrowFunctionExpression' and node.isAsync and 
+                metadata.start.offset in self.async_calls):
+            # the call is not part of the AST
+            self.async_calls.remove(metadata.start.offset)
+            self.function_calls -= 1
+
+# recursion limit and thread stack size used to parse deeply nested JS
+DEEP_RECURSION_LIMIT = 200000
+DEEP_STACK_SIZE = 1024 * 1024 * 1024
+
+def run_with_deep_stack(function, *args, **kwargs):
+    """
+    Returns function(*args, **kwargs), executed in a thread with a big stack 
+    and a higher recursion limit. esprima is a recursive descent parser: 
+    nested expressions quickly exceed the default recursion limit.
+    """
+    result = {}
+    def target():
+        try:
+            result['value'] = function(*args, **kwargs)
+        except BaseException as e:
+            result['error'] = e
+    recursion_limit = sys.getrecursionlimit()
+    stack_size = threading.stack_size(DEEP_STACK_SIZE)
+    try:
+        sys.setrecursionlimit(DEEP_RECURSION_LIMIT)
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+        threading.stack_size(stack_size)
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+# lexical approximation of the JS features, see lexical_javascript
+JS_IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+JS_FUNCTION = re.compile(r'\bfunction\b')
+JS_FUNCTION_NAME = re.compile(r'\bfunction\s*\*?\s*[A-Za-z_$][\w$]*\s*\(')
+JS_FUNCTION_DECLARATION = re.compile(
+    r'(?:^|[;{}])\s*function\s*\*?\s*[A-Za-z_$][\w$]*\s*\(')
+JS_CALL = re.compile(r'([A-Za-z_$][\w$]*|[)\]])\s*\(')
+JS_KEYWORDS_BEFORE_PARENTHESIS = frozenset(['if', 'for', 'while', 'switch', 
+    'catch', 'function', 'return', 'typeof', 'void', 'delete', 'in', 'of', 
+    'with', 'do', 'else', 'case', 'throw', 'await', 'yield', 'new'])
+
+def lexical_javascript(string, domObjects, properties, methods):
+    """
+    Returns the same features as parse_javascript, approximated with regexes
+    instead of esprima, in linear time. Used when a JS code exceeds its 
+    budget. Identifiers are also counted inside strings and comments, and 
+    function declarations and calls are guessed from the surrounding tokens.
+    """
+    data = {}
+    data['js_length'] = len(string)
+    for i in domObjects:
+        data['js_dom_'+i] = 0
+    for i in properties:
+        data['js_prop_'+i] = 0
+    for i in methods:
+        data['js_method_'+i] = 0
+    for identifier in JS_IDENTIFIER.findall(string):
+        if identifier in domObjects:
+            data['js_dom_'+identifier] += 1
+        elif identifier in properties:
+            data['js_prop_'+identifier] += 1
+        elif identifier in methods:
+            data['js_method_'+identifier] += 1
+    declarations = len(JS_FUNCTION_DECLARATION.findall(string))
+    data['js_define_function'] = declarations
+    data['js_string_max_length'] = 0
+    calls = sum(1 for i in JS_CALL.findall(string) 
+        if i not in JS_KEYWORDS_BEFORE_PARENTHESIS)
+    # `function name(` is not a call
+    calls -= len(JS_FUNCTION_NAME.findall(string))
+    function_expressions = len(JS_FUNCTION.findall(string)) - declarations
+    data['js_function_calls'] = max(calls, 0) + max(function_expressions, 0)
+    data['js_degraded'] = True
+    return data
+
+def parse_javascript(string, domObjects, properties, methods, filename = None,
+        budget = None, deadline = None):
     """
     Parse a string representing JS code and return a dict containing 
-    features
+    features.
+    If budget (a Budget) is provided, codes bigger than budget.script_bytes,
+    or whose AST has more than budget.script_nodes nodes, or parsed after 
+    deadline (a time.monotonic() value), are approximated by 
+    lexical_javascript. The dict then contains js_degraded.
     """
+    if budget is not None:
+        if ((budget.script_bytes is not None and 
+                len(string) > budget.script_bytes) or 
+                (deadline is not None and time.monotonic() > deadline)):
+            counters['degraded_scripts'] += 1
+            return lexical_javascript(string, domObjects, properties, methods)
     data = {}
     data['js_length'] = len(string)
     # init 
@@ -110,32 +559,37 @@ def parse_javascript(string, domObjects, properties, methods, filename = None):
     # https://github.com/Kronuz/esprima-python
     # tolerant to continue if strict JS is not respected, see:
     # http://esprima.readthedocs.io/en/4.0/syntactic-analysis.html#tolerant-mode
-    # for the definition of the tree, see:
-    # https://github.com/estree/estree/blob/master/es5.md
+    options = {'tolerant':True, 'tokens': True}
+    counters['scripts_parsed'] += 1
+    max_nodes = None if budget is None else budget.script_nodes
+    node_counter = NodeCounter(max_nodes, deadline)
     try:
-        esprimaObject = esprima.parseScript(string, options={'tolerant':True, 
-            'tokens': True}).toDict()
+        try:
+            esprimaObject = esprima.parseScript(string, options=options, 
+                delegate=node_counter)
+        except RecursionError:
+            # deeply nested code
+            node_counter = NodeCounter(max_nodes, deadline)
+            esprimaObject = run_with_deep_stack(esprima.parseScript, string, 
+                options=options, delegate=node_counter)
+    except BudgetExceeded:
+        counters['degraded_scripts'] += 1
+        return lexical_javascript(string, domObjects, properties, methods)
     except (esprima.error_handler.Error, RecursionError) as e:
-        print('[ERROR] Invalid JS in {0}, on code: {1}'.format(filename, string))
-        print(e)
+        counters['esprima_errors'] += 1
+        logger.error('[ERROR] Invalid JS in %s, on code: %s', filename, string)
+        logger.error('%s', e)
         return None
         # Sometime the JS code is broken by the xss exploit, e.g:
         # html/xssed/full/6327ecf75cb4392df52394c2c9b01e1321b0310e:
         # <a href="JavaScript: openLookup('calendar.jsp?form=stock_form&ip=startDate&d=" onmouseover=alert(document.cookie) ...
 
     ## Syntactic Analysis
-    for node in node_generator(esprimaObject['body']):
-        try:
-            if node['type'] in ['FunctionDeclaration', ]: # Function Declaration
-                data['js_define_function'] += 1
-            elif node['type'] in ['CallExpression', 'FunctionExpression']: # function or method calls
-                data['js_function_calls'] += 1
-        except KeyError:
-            # some node don't have a type, e.g: 
-            # {'flags': '', 'pattern': '^([a-zA-Z0-9_-])+@([a-zA-Z0-9_-])+((\\.[a-zA-Z0-9_-]{2,3}){1,2})$'}
-            continue
+    # nodes are counted by node_counter while esprima builds the AST
+    data['js_define_function'] = node_counter.define_function
+    data['js_function_calls'] = node_counter.function_calls
     ## Lexical Analysis
-    tokens = esprimaObject['tokens']
+    tokens = esprimaObject.tokens
     # We use lexical analysis to detect dom, prop, and methods instead of 
     # syntactic analysis, for simplicity because of this case:
     #    var test = alert;
@@ -144,18 +598,20 @@ def parse_javascript(string, domObjects, properties, methods, filename = None):
     # Set.constructor`alert\x28document.domain\x29```
     # https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet#ECMAScript_6
     for token in tokens:
-        if token['type'] == 'Identifier':
-            if token['value'] in domObjects:
-                data['js_dom_'+token['value']] += 1
-            elif token['value'] in properties:
-                data['js_prop_'+token['value']] += 1
-            elif token['value'] in methods:
-                data['js_method_'+token['value']] += 1
-        elif token['value'] == "string":
-            stringsList.append(tokens['value'])
+        if token.type == 'Identifier':
+            if token.value in domObjects:
+                data['js_dom_'+token.value] += 1
+            elif token.value in properties:
+                data['js_prop_'+token.value] += 1
+            elif token.value in methods:
+                data['js_method_'+token.value] += 1
+        elif token.value == "string":
+            stringsList.append(token.value)
     # max length of strings
     if len(stringsList) > 0:
         data['js_string_max_length'] = max([len(i) for i in stringsList])
+    if budget is not None:
+        data['js_degraded'] = False
     return data
 
 def js_protocol(string):
@@ -166,42 +622,291 @@ def js_protocol(string):
     # ignore case, white space, and new line (important)
     # HTML entities are correctly handled by the HTML parser, see 
     # https://github.com/Framartin/adv_ex_xss/issues/1#issuecomment-325464896
-    is_js = re.search(r'^\s*javascript:(.*)', string, 
-        flags=(re.IGNORECASE|re.DOTALL))
+    is_js = JS_PROTOCOL.search(string)
     if bool(is_js):
         return is_js.group(1)
     else:
         return None
 
 
-def parse_html_file(filename):
+# tags that can execute JS using the javascript: pseudo-protocol, and the
+# attribute containing the URL
+JS_PROTOCOL_ATTRS = {'a': 'href', 'form': 'action', 'iframe': 'src',
+    'frame': 'src'}
+
+# backends available to parse HTML. All but 'stream' are BeautifulSoup tree
+# builders ('lxml' requires the lxml package). 'stream' is a tokenizer that
+# does not build the tree at all (see StreamParser).
+PARSERS = ('html5lib', 'lxml', 'html.parser', 'stream')
+
+class StreamTag(object):
+    """
+    Minimal element produced by StreamParser, exposing the attributes of
+    bs4.Tag used by visit_dom: name, attrs and string (the content of <script>)
+    """
+    __slots__ = ('name', 'attrs', 'string')
+
+    def __init__(self, name, attrs, string = None):
+        self.name = name
+        self.attrs = attrs
+        self.string = string
+
+    def __str__(self):
+        attrs = ''.join(' {0}="{1}"'.format(k, v) for k, v in self.attrs.items())
+        return '<{0}{1}>{2}</{0}>'.format(self.name, attrs, self.string or '')
+
+# elements whose content is text, not markup (html.parser only knows
+# <script> and <style>)
+RAW_TEXT_ELEMENTS = ('script', 'style', 'textarea', 'title', 'xmp', 'iframe',
+    'noembed', 'noframes')
+
+class StreamParser(HTMLParser):
+    """
+    Streaming HTML tokenizer based on html.parser. It collects the start tags 
+    as StreamTag, in the order of the document, without building the DOM. 
+    <script> elements are collected at their end tag (or at the end of the
+    document) to get their content.
+    Contrary to html5lib, the HTML5 tree construction rules are not applied 
+    (implied tags, misnested tags, etc.), so some features may differ. See 
+    compare_parsers.py.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.elements = []
+        self._script = None # <script> being read
+        self._script_data = []
+
+    def handle_starttag(self, name, attrs):
+        attributes = {}
+        for attr, value in attrs:
+            # like html5lib: keep the first duplicated attribute, and 
+            # attributes without value are empty strings
+            attributes.setdefault(attr, '' if value is None else value)
+        element = StreamTag(name, attributes)
+        if name in RAW_TEXT_ELEMENTS:
+            # like HTML5: the content of these elements is not parsed as tags
+            self.set_cdata_mode(name)
+        if name == 'script':
+            self._end_script()
+            self._script = element
+            self._script_data = []
+        else:
+            self.elements.append(element)
+
+    def handle_data(self, data):
+        if self._script is not None:
+            self._script_data.append(data)
+
+    def handle_endtag(self, name):
+        if name == 'script':
+            self._end_script()
+
+    def _end_script(self):
+        if self._script is not None:
+            # like bs4: an empty <script> has no string
+            self._script.string = ''.join(self._script_data) or None
+            self.elements.append(self._script)
+            self._script = None
+
+    def close(self):
+        super().close()
+        self._end_script()
+
+def html_elements(raw_html, parser = 'html5lib'):
+    """
+    Parses raw_html with the parser backend (one of PARSERS) and returns an 
+    iterable of its elements, in the order of the document
+    """
+    if parser == 'stream':
+        stream_parser = StreamParser()
+        stream_parser.feed(raw_html)
+        stream_parser.close()
+        return stream_parser.elements
+    soup = BeautifulSoup(raw_html, parser)
+    return (tag for tag in soup.descendants if isinstance(tag, Tag))
+
+def visit_dom(elements, data, tags = TAGS, attrs = ATTRS, 
+        eventHandlersAttrs = EVENTHANDLERSATTRS, filename = None):
+    """
+    Browses once every element of elements (see html_elements) to count tags,
+    attributes and event handlers inside data (a dict whose counters are 
+    already initialized by parse_html), and to set data['js_file'] and
+    data['js_pseudo_protocol'].
+    Returns the list of the JS codes found in the page, ordered by source (see
+    below), then by position in the document.
+    """
+    tags = set(tags)
+    attrs = set(attrs)
+    events = set(eventHandlersAttrs)
+    # JS will be extracted from <script> tag, event handlers, javascript: link
+    # cf: https://stackoverflow.com/questions/12008172/how-many-ways-are-to-call-javascript-code-from-html
+    scripts = []
+    js_protocols = {name: [] for name in JS_PROTOCOL_ATTRS}
+    js_events = {event: [] for event in eventHandlersAttrs}
+    for tag in elements:
+        name = tag.name
+        if name in tags:
+            data['html_tag_' + name] += 1
+        if name == 'script':
+            if 'src' in tag.attrs:
+                # reference to JS file
+                data['js_file'] = True
+            else:
+                # 1. from <script>
+                javascript = tag.string
+                if javascript is None:
+                    # check is None, ie. <script> has a child node
+                    logger.info('[INFO] Skipping a ill-formed <script> in file %s: %s', filename, tag)
+                else:
+                    scripts.append(javascript)
+        elif name in JS_PROTOCOL_ATTRS:
+            # 2. JS executed from javascript: links
+            # 3. JS executed from javascript form
+            # 4. JS executed from javascript iframe
+            # https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet#IFRAME
+            # 5. JS executed from javascript frame
+            # https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet#FRAME
+            url = tag.attrs.get(JS_PROTOCOL_ATTRS[name])
+            if url is not None:
+                javascript = js_protocol(url)
+                if javascript:
+                    js_protocols[name].append(javascript)
+                    data['js_pseudo_protocol'] = True
+        for attr, value in tag.attrs.items():
+            if attr in attrs:
+                data['html_attr_' + attr] += 1
+            if attr in events:
+                data['html_event_' + attr] += 1
+                # 6. JS executed from EventHandlers
+                js_events[attr].append(value)
+    javascriptStrings = scripts
+    for name in JS_PROTOCOL_ATTRS:
+        javascriptStrings += js_protocols[name]
+    for event in eventHandlersAttrs:
+        javascriptStrings += js_events[event]
+    return javascriptStrings
+
+@lru_cache(maxsize=None)
+def open_page_store(folder, pid = None):
+    """
+    Returns the PageStore at folder, opened once per process (pid), or None
+    if folder is a plain folder of HTML files
+    """
+    if is_page_store(folder):
+        return PageStore(folder)
+    return None
+
+def list_pages(folder):
+    """
+    Returns the names of the pages of folder, a folder of HTML files or a 
+    PageStore
+    """
+    store = open_page_store(folder, getpid())
+    if store is not None:
+        return list(store.keys())
+    return listdir(folder)
+
+def read_page(filename):
+    """
+    Returns the content of the HTML file filename, as bytes. If the folder of
+    filename is a PageStore, the page is read from the store. Raises 
+    FileNotFoundError if the page doesn't exist.
+    """
+    folder, name = split(filename)
+    store = open_page_store(folder, getpid())
+    if store is not None:
+        try:
+            return store.get(name)
+        except KeyError:
+            raise FileNotFoundError(filename)
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def parse_html_file(filename, parser = 'html5lib', cache = None, 
+        js_cache = None, budget = None, out = None):
     """
-    Parses filename and returns a dict of features for future model uses
+    Parses filename and returns a dict of features for future model uses.
+    If cache (a FeatureCache) is provided, the features of files whose
+    content was already parsed are read from the cache (except approximated
+    ones, see Budget). js_cache (a JavascriptCache), budget (a Budget) and 
+    out (where the features are written) are used by parse_html.
     """
     try:
-        with open(filename, 'r', errors='backslashreplace') as f:
-            # avoid UnicodeDecodeError, e.g with file: 
-            # xssed/full/6327ecf75cb4392df52394c2c9b01e1321b0310e
-            raw_html = f.read()
-            return parse_html(raw_html, filename = filename)
+        with timer('read'):
+            raw = read_page(filename)
     except FileNotFoundError as e:
-        print("File not found. Skipping file: {0}".format(filename))
+        logger.warning("File not found. Skipping file: %s", filename)
         return None
+    counters['bytes_read'] += len(raw)
+    if cache is not None:
+        with timer('cache'):
+            key = cache.key(raw, parser, budget)
+            data = cache.get(key)
+        if data is not None:
+            counters['cache_hits'] += 1
+            if out is not None:
+                out.update(data)
+                return out
+            return data
+        counters['cache_misses'] += 1
+    # decode as open(filename, 'r', errors='backslashreplace') would do
+    # avoid UnicodeDecodeError, e.g with file: 
+    # xssed/full/6327ecf75cb4392df52394c2c9b01e1321b0310e
+    with timer('decode'):
+        raw_html = TextIOWrapper(BytesIO(raw), 
+            errors='backslashreplace').read()
+    if cache is not None:
+        # the cache stores the features as returned by parse_html
+        data = parse_html(raw_html, filename = filename, parser = parser, 
+            js_cache = js_cache, budget = budget)
+        if not data.get('degraded', False):
+            with timer('cache'):
+                cache.put(key, data)
+        if out is not None:
+            out.update(data)
+            return out
+        return data
+    return parse_html(raw_html, filename = filename, parser = parser, 
+        js_cache = js_cache, budget = budget, out = out)
 
 def parse_html(raw_html,
             tags = TAGS, # tags to count
             attrs = ATTRS, # attributes to count
             eventHandlersAttrs = EVENTHANDLERSATTRS,
             keywords_evil = KEYWORDS_EVIL,
+            domObjects = JS_DOM_OBJECTS, # JS identifiers to count
+            properties = JS_PROPERTIES,
+            methods = JS_METHODS,
             filename = None, # for logging infos and errors
+            parser = 'html5lib', # HTML parser backend, see PARSERS
+            js_cache = None, # JavascriptCache
+            budget = None, # Budget
+            out = None, # mapping where the features are written
             ):
     """
     Parses raw_html as a string containing HTML and returns a dict of features
-    for future model uses
+    for future model uses. If out is provided (ex: a FeatureRow), the 
+    features are written in out, which is returned.
+    If budget (a Budget) is provided, only the first budget.html_bytes 
+    characters are parsed, and the JS codes over budget (see 
+    parse_javascript) are approximated. The dict then contains 'degraded', 
+    True if some features were approximated.
     """
-    soup = BeautifulSoup(raw_html, "html5lib")
+    deadline = None
+    degraded = False
+    full_html = raw_html
+    if budget is not None:
+        if budget.seconds is not None:
+            deadline = time.monotonic() + budget.seconds
+        if budget.html_bytes is not None and len(raw_html) > budget.html_bytes:
+            # truncated DOM
+            raw_html = raw_html[:budget.html_bytes]
+            degraded = True
+    counters['documents'] += 1
+    with timer('tree'):
+        elements = html_elements(raw_html, parser)
     ## Init variables
-    data = {}
+    data = {} if out is None else out
 
     for tag in tags:
         data['html_tag_' + tag] = 0
@@ -212,78 +917,28 @@ def parse_html(raw_html,
     for event in eventHandlersAttrs:
         data['html_event_' + event] = 0
     # keywords evil
-    data['html_number_keywords_evil'] = 0
-    for keyword in keywords_evil:
-        data['html_number_keywords_evil'] += len(re.findall(keyword, raw_html, 
-            flags=re.IGNORECASE))
+    with timer('keywords'):
+        data['html_number_keywords_evil'] = sum(html_keyword_matcher(
+            tuple(keywords_evil)).count(raw_html))
     # reference to JS file
-    data['js_file'] = bool(soup.find_all('script', src=True))
+    data['js_file'] = False
     data['js_pseudo_protocol'] = False
 
-    ## Extract JS code
-    # JS will be extracted from <script> tag, event handlers, javascript: link
-    # cf: https://stackoverflow.com/questions/12008172/how-many-ways-are-to-call-javascript-code-from-html
-    javascriptStrings = []
-    # 1. from <script>
-    for tag in soup.find_all('script', src=False):
-        javascript = tag.string
-        if javascript is None:
-            # check is None, ie. <script> has a child node
-            print('[INFO] Skipping a ill-formed <script> in file {0}: {1}'.format(filename, tag))
-        else:
-            javascriptStrings.append(javascript)
-    # 2. JS executed from javascript: links
-    for tag in soup.find_all('a', attrs={'href':True}):
-        javascript = js_protocol(tag['href'])
-        if javascript:
-            javascriptStrings.append(javascript)
-            data['js_pseudo_protocol'] = True
-    # 3. JS executed from javascript form
-    for tag in soup.find_all('form', attrs={'action':True}):
-        javascript = js_protocol(tag['action'])
-        if javascript:
-            javascriptStrings.append(javascript)
-            data['js_pseudo_protocol'] = True
-    # 4. JS executed from javascript iframe
-    # https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet#IFRAME
-    for tag in soup.find_all('iframe', attrs={'src':True}):
-        javascript = js_protocol(tag['src'])
-        if javascript:
-            javascriptStrings.append(javascript)
-            data['js_pseudo_protocol'] = True
-    # 5. JS executed from javascript frame
-    # https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet#FRAME
-    for tag in soup.find_all('frame', attrs={'src':True}):
-        javascript = js_protocol(tag['src'])
-        if javascript:
-            javascriptStrings.append(javascript)
-            data['js_pseudo_protocol'] = True
-
-    ## count tags
-    for tag in tags:
-        data['html_tag_' + tag] = len(soup.find_all(tag))
-    ## count attributes
-    for attr in attrs:
-        data['html_attr_' + attr] = len(soup.find_all(attrs={attr: True}))
-    ## count event handlers
-    for event in eventHandlersAttrs:
-        event_tags = soup.find_all(attrs={event: True})
-        data['html_event_' + event] = len(event_tags)
-        # 6. JS executed from EventHandlers
-        for event_tag in event_tags:
-            javascriptStrings.append(event_tag[event])
+    ## count tags, attributes, event handlers and extract JS code
+    with timer('visit'):
+        javascriptStrings = visit_dom(elements, data, tags=tags, attrs=attrs, 
+            eventHandlersAttrs=eventHandlersAttrs, filename=filename)
     ## parse JS code
-    domObjects = ('windows', 'location', 'document')
-    properties = ('cookie', 'document', 'referrer') #location
-    methods = ('write', 'getElementsByTagName', 'alert', 'eval', 'fromCharCode',
-        'prompt', 'confirm', 'fetch')
     data_js = [] # list of the features of JS codes 
-    for js in javascriptStrings:
-        # parse each JS code
-        data_current_js = parse_javascript(js, domObjects=domObjects, 
-            properties=properties, methods=methods, filename=filename)
-        if data_current_js is not None: # esprima successfully parse the code
-            data_js.append(data_current_js)
+    parse_js = parse_javascript if js_cache is None else js_cache.parse
+    with timer('javascript'):
+        for js in javascriptStrings:
+            # parse each JS code
+            data_current_js = parse_js(js, domObjects=domObjects, 
+                properties=properties, methods=methods, filename=filename,
+                budget=budget, deadline=deadline)
+            if data_current_js is not None: # esprima successfully parse it
+                data_js.append(data_current_js)
     # process the features: from features at JS level to features at html
     # level
     # max dom, prop, and methods
@@ -307,40 +962,45 @@ def parse_html(raw_html,
     data['js_string_max_length'] = max([i['js_string_max_length'] for i in data_js])
     
     ## other html features
-    data['html_length'] = len(raw_html)
+    data['html_length'] = len(full_html)
+    if budget is not None:
+        degraded = degraded or any(i.get('js_degraded', False) 
+            for i in data_js)
+        data['degraded'] = degraded
+        counters['degraded_documents'] += degraded
     return data
 
 def parse_url(string, tags=TAGS, attrs=ATTRS, 
     eventHandlersAttrs = EVENTHANDLERSATTRS, keywords_param=KEYWORDS_PARAM, 
-    keywords_evil=KEYWORDS_EVIL):
+    keywords_evil=KEYWORDS_EVIL, out=None):
     """
-    Parses a URL as str and returns a dict of features for future model uses
+    Parses a URL as str and returns a dict of features for future model uses.
+    If out is provided (ex: a FeatureRow), the features are written in out, 
+    which is returned.
     """
     string = urldecode(string)
-    data = {}
+    data = {} if out is None else out
     data['url_length'] = len(string)
     data['url_duplicated_characters'] = ('<<' in string) or ('>>' in string)
     #data['url_special_characters'] = any(i in string for i in '"\'>') 
         # ex: ", ">, "/> 
         # idea to bypass: using `
+    tag_matcher, name_matcher, param_matcher, evil_matcher = url_matchers(
+        tuple(tags), tuple(attrs) + tuple(eventHandlersAttrs), 
+        tuple(keywords_param), tuple(keywords_evil))
+    tags_found = tag_matcher.search(string)
     for tag in tags:
-        data['url_tag_'+tag] = bool(
-            re.search('<\s*'+tag+'.*>|<\s*/\s*'+tag+'\s*>', string, 
-            flags=re.IGNORECASE))
+        data['url_tag_'+tag] = tag in tags_found
         # TODO: handle HTML entities?
         # check for whitespace and ignore case
         # checked on https://www.owasp.org/index.php/XSS_Filter_Evasion_Cheat_Sheet
+    names_found = name_matcher.search(string)
     for attr in attrs:
-        data['url_attr_'+attr] = bool(re.search(attr+'\s*=', string, 
-            flags=re.IGNORECASE))
+        data['url_attr_'+attr] = attr in names_found
     for event in eventHandlersAttrs:
-        data['url_event_'+event] = bool(re.search(attr+'\s*=', string, 
-            flags=re.IGNORECASE))
+        data['url_event_'+event] = event in names_found
     data['url_cookie'] = ('document.cookie' in string)
-    data['url_redirection'] = any(i in string for i in ['window.location', 
-        'window.history', 'window.navigate', 'document.URL', 
-        'document.documentURI', 'document.URLUnencoded', 'document.baseURI',
-        'location', 'window.open', 'self.location', 'top.location'])
+    data['url_redirection'] = bool(REDIRECTION.search(string))
         # From paper:
         # window.location, window.history, window.navigate
         # From: https://code.google.com/archive/p/domxsswiki/wikis/LocationSources.wiki
@@ -355,19 +1015,243 @@ def parse_url(string, tags=TAGS, attrs=ATTRS,
         #         $(location).prop('href', 'http://www.example.com')
         # https://stackoverflow.com/a/4745012
         # document.location
-    data['url_number_keywords_param'] = sum(i in string.lower() for i in keywords_param)
-    data['url_number_keywords_evil'] = sum(i in string.lower() for i in keywords_evil)
-    data['url_number_domain'] = len(re.findall(
-        r'(?:(?!-)[A-Za-z0-9-]{1,63}(?!-)\.)+[A-Za-z]{2,6}', string))
+    # number of keywords present in the URL
+    string_lower = string.lower()
+    data['url_number_keywords_param'] = sum(i > 0 for i in 
+        param_matcher.count(string_lower))
+    data['url_number_keywords_evil'] = sum(i > 0 for i in 
+        evil_matcher.count(string_lower))
+    data['url_number_domain'] = len(DOMAIN.findall(string))
         # adapted from: http://www.mkyong.com/regular-expressions/domain-name-regular-expression-example/
         # idea to bypass: IDN domain names: https://stackoverflow.com/a/26987741
         # becareful to decode URL before
-    data['url_number_ip'] = len(re.findall(
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(\.\d{1,3}\.\d{1,3})?', string))
+    data['url_number_ip'] = len(IP.findall(string))
         # add number of IP addresses v4 or v6
         # https://stackoverflow.com/a/44891763
     return data
 
+def extractor_version():
+    """
+    Returns a hash identifying the version of the feature extractor: the 
+    source of this module (the code computing the features, the regexes and
+    the configuration it uses, and the decoding of the pages), the encoding
+    used to decode the pages, and the versions of Python and of the parsing 
+    libraries
+    """
+    version = sha1()
+    config = [locale.getpreferredencoding(False), platform.python_version(),
+        bs4.__version__, html5lib.__version__, esprima.version]
+    version.update(json.dumps(config).encode())
+    with open(__file__, 'rb') as f:
+        version.update(f.read())
+    return version.hexdigest()
+
+class FeatureCache(object):
+    """
+    Persistent cache of the features of HTML files, stored in a SQLite 
+    database. Features are indexed by a hash of the content of the file, of the
+    parsing options, and of the version of the feature extractor (see 
+    extractor_version), so the cache is invalidated automatically when the
+    configuration or the parsing code change. 
+    Each process should open its own FeatureCache (see open_cache).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.version = extractor_version()
+        # autocommit. WAL allows the worker processes to read while another
+        # one writes
+        self.connection = sqlite3.connect(path, timeout=120, 
+            isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # features: of HTML files, js: of JS codes (see JavascriptCache)
+        for table in self.TABLES:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS {0} '
+                '(key TEXT PRIMARY KEY, version TEXT, features TEXT)'.format(
+                table))
+
+    TABLES = ('features', 'js')
+
+    def key(self, raw, *options):
+        """Input the content of a file as bytes and the parsing options"""
+        key = sha1(self.version.encode())
+        key.update(json.dumps(options).encode())
+        key.update(raw)
+        return key.hexdigest()
+
+    def get(self, key, table = 'features', default = None):
+        assert table in self.TABLES
+        row = self.connection.execute('SELECT features FROM {0} WHERE '
+            'key = ?'.format(table), (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, key, data, table = 'features'):
+        assert table in self.TABLES
+        self.connection.execute('INSERT OR REPLACE INTO {0} VALUES '
+            '(?, ?, ?)'.format(table), (key, self.version, json.dumps(data)))
+
+    def prune(self):
+        """
+        Deletes the features computed by previous versions of the extractor.
+        Returns the number of deleted entries.
+        """
+        return sum(self.connection.execute('DELETE FROM {0} WHERE '
+            'version != ?'.format(table), (self.version,)).rowcount 
+            for table in self.TABLES)
+
+@lru_cache(maxsize=None)
+def open_cache(path, pid = None):
+    """
+    Returns the FeatureCache stored at path, opened once per process (pid,
+    as SQLite connections cannot be shared with forked processes) 
+    """
+    return FeatureCache(path)
+
+class JavascriptCache(object):
+    """
+    Bounded LRU cache of the features returned by parse_javascript. The same
+    JS codes (event handlers, analytics snippets, javascript:void(0), etc.) 
+    are found thousands of times across the corpus.
+    Entries are keyed on a hash of the code and of the configuration 
+    (domObjects, properties and methods). If disk (a FeatureCache) is 
+    provided, entries are also shared on disk between processes and runs.
+    Codes that esprima cannot parse are cached too: their error is only 
+    logged the first time.
+    Hits and misses are counted in counters.
+    """
+    def __init__(self, maxsize = 65536, disk = None):
+        self.maxsize = maxsize
+        self.disk = disk
+        self.entries = OrderedDict()
+        self.configs = {}
+
+    def key(self, string, domObjects, properties, methods):
+        config = (domObjects, properties, methods)
+        if config not in self.configs:
+            self.configs[config] = json.dumps(config).encode()
+        key = sha1(self.configs[config])
+        key.update(string.encode('utf-8', 'surrogatepass'))
+        return key.hexdigest()
+
+    def parse(self, string, domObjects, properties, methods, filename = None,
+            budget = None, deadline = None):
+        """
+        Returns parse_javascript(string, domObjects, properties, methods, 
+        filename, budget, deadline), from the cache if possible. Approximated 
+        features (over budget) are not cached.
+        """
+        domObjects, properties, methods = (tuple(domObjects), 
+            tuple(properties), tuple(methods))
+        key = self.key(string, domObjects, properties, methods)
+        if key in self.entries:
+            counters['js_cache_hits'] += 1
+            self.entries.move_to_end(key)
+            data = self.entries[key]
+        else:
+            data = MISSING
+            if self.disk is not None:
+                data = self.disk.get(key, 'js', default=MISSING)
+            if data is MISSING:
+                counters['js_cache_misses'] += 1
+                data = parse_javascript(string, domObjects, properties, 
+                    methods, filename = filename, budget = budget, 
+                    deadline = deadline)
+                if data is not None and data.get('js_degraded', False):
+                    return data
+                if self.disk is not None:
+                    self.disk.put(key, data, 'js')
+            else:
+                counters['js_cache_disk_hits'] += 1
+            self.entries[key] = data
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                counters['js_cache_evictions'] += 1
+        # callers may modify the dict
+        return None if data is None else dict(data)
+
+# default value of JavascriptCache
+MISSING = object()
+
+@lru_cache(maxsize=None)
+def open_js_cache(maxsize, cache_path = None, pid = None):
+    """
+    Returns a JavascriptCache of maxsize entries, created once per process, 
+    and stored on disk in the FeatureCache at cache_path (if any)
+    """
+    disk = None
+    if cache_path is not None:
+        disk = open_cache(cache_path, pid)
+    return JavascriptCache(maxsize, disk)
+
+class FeatureExtractor(object):
+    """
+    Reusable feature extractor, ex: to score pages with a model. The 
+    configuration, the matchers and the JS cache are built once, and the 
+    features of a page are returned as a vector, in the fixed order of 
+    columns. Nothing is printed: messages go to logger.
+    Not thread-safe: use one FeatureExtractor per thread or process.
+    """
+    def __init__(self, tags = TAGS, attrs = ATTRS, 
+            eventHandlersAttrs = EVENTHANDLERSATTRS, 
+            keywords_param = KEYWORDS_PARAM, keywords_evil = KEYWORDS_EVIL,
+            domObjects = JS_DOM_OBJECTS, properties = JS_PROPERTIES, 
+            methods = JS_METHODS, parser = 'html5lib', js_cache_size = 65536,
+            budget = None, dtype = MATRIX_DTYPE):
+        self.tags = tuple(tags)
+        self.attrs = tuple(attrs)
+        self.eventHandlersAttrs = tuple(eventHandlersAttrs)
+        self.keywords_param = tuple(keywords_param)
+        self.keywords_evil = tuple(keywords_evil)
+        self.domObjects = tuple(domObjects)
+        self.properties = tuple(properties)
+        self.methods = tuple(methods)
+        self.parser = parser
+        self.budget = budget
+        self.dtype = dtype
+        self.js_cache = None
+        if js_cache_size > 0:
+            self.js_cache = JavascriptCache(js_cache_size)
+        # names of the features, without the class
+        self.columns = feature_names(self.tags, self.attrs, 
+            self.eventHandlersAttrs, self.domObjects, self.properties, 
+            self.methods, degraded = budget is not None)[1:]
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        # build the matchers now rather than on the first page
+        url_matchers(self.tags, self.attrs + self.eventHandlersAttrs, 
+            self.keywords_param, self.keywords_evil)
+        html_keyword_matcher(self.keywords_evil)
+
+    def extract(self, url, html, out = None):
+        """
+        Returns the features of the page at url, whose content is html (str),
+        as an array of len(columns), written in out if provided
+        """
+        if out is None:
+            out = np.zeros(len(self.columns), dtype=self.dtype)
+        row = FeatureRow(out, self.index)
+        parse_url(url, self.tags, self.attrs, self.eventHandlersAttrs, 
+            self.keywords_param, self.keywords_evil, out = row)
+        parse_html(html, self.tags, self.attrs, self.eventHandlersAttrs, 
+            self.keywords_evil, self.domObjects, self.properties, 
+            self.methods, parser = self.parser, js_cache = self.js_cache, 
+            budget = self.budget, out = row)
+        return out
+
+    def extract_many(self, batch, out = None):
+        """
+        Returns the features of batch, an iterable of (url, html) tuples, as a
+        matrix with a row per page, written in out if provided
+        """
+        if not isinstance(batch, (list, tuple)):
+            batch = list(batch)
+        if out is None:
+            out = np.zeros((len(batch), len(self.columns)), dtype=self.dtype)
+        for i, (url, html) in enumerate(batch):
+            self.extract(url, html, out[i])
+        return out
+
 def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '█'):
     """
     Code from: https://stackoverflow.com/a/34325723
@@ -389,60 +1273,530 @@ def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1,
     if iteration == total: 
         print()
 
-def main():
-    data = []
-    data_rw = import_json('randomwalk.json')
-    number_pages_total = len(data_rw)
-    path_randomwalk = 'html/randomsample/subsample/'
-    files_randomwalk = [path_randomwalk+i for i in listdir(path_randomwalk)]
-    # Initial call to print 0% progress
-    printProgressBar(0, number_pages_total, prefix = 'Progress:', 
-        suffix = 'Complete', length = 50)
-    for i, page in enumerate(data_rw):
-        feature_class = {'class': 0} # benign
-        # regexp to be compatible with spider before commit b651f88
-        file_path = re.sub(r'html/randomsample(/full)?/', path_randomwalk,
+# regexp to be compatible with spider before commit b651f88
+RANDOMWALK_FOLDER = re.compile(r'html/randomsample(/full)?/')
+
+class CorpusIndex(object):
+    """
+    Index of the HTML files available in the folders of the corpora, to map 
+    the items of the spiders' feeds to their file in constant time. Files can
+    be missing because they were removed (duplicated or oversized pages), or
+    are not part of the subsample: these items are counted in missing, and 
+    written to the CSV file report (if any).
+    """
+    def __init__(self, path_randomwalk = 'html/randomsample/subsample/', 
+            path_xssed = 'html/xssed/full/', report = None):
+        # the folders can also be PageStores
+        self.path_randomwalk = join(path_randomwalk, '')
+        self.path_xssed = join(path_xssed, '')
+        self.files_randomwalk = frozenset(list_pages(path_randomwalk))
+        self.files_xssed = frozenset(list_pages(path_xssed))
+        self.missing = Counter()
+        self.report = report
+
+    def randomwalk_path(self, page):
+        """
+        Returns the path of the HTML file of page, an item of the randomwalk 
+        spider, or None if it is not available
+        """
+        file_path = RANDOMWALK_FOLDER.sub(self.path_randomwalk, 
             page['file_path'])
-        if file_path not in files_randomwalk:
-            continue
-        features_html = parse_html_file(file_path)
-        if features_html is None: # file not found, do not write
-            continue
-        features_url = parse_url(page['url'])
-        # merge dicts
-        features_page = {**feature_class, **features_url, **features_html}
-        data.append(features_page)
-        if i % 20 == 0:
-            printProgressBar(i + 1, number_pages_total, prefix = 'Progress benign:',
-                suffix = 'Complete', length = 50)
-    data_xssed = import_json('xssed.json')
-    path_xssed = 'html/xssed/full/'
-    files_xssed = ['full/'+i for i in listdir(path_xssed)]
-    number_pages_total = len(data_xssed)
-    for i, page in enumerate(data_xssed):
+        name = file_path[len(self.path_randomwalk):]
+        if (file_path.startswith(self.path_randomwalk) and 
+                name in self.files_randomwalk):
+            return file_path
+        return None
+
+    def xssed_path(self, page):
+        """
+        Returns the path of the HTML file of page, an item of the xssed 
+        spider, or None if no file was downloaded or it is not available
+        """
         try:
             file_path = page['files'][0]['path'] # fin the form: full/xxxx
         except IndexError:
             # no file downloaded
             # some mirrored pages are buggy, e.g 
             # http://vuln.xssed.net/2012/02/16/the-ethical-hacker.com/
-            print('[INFO] skipping xss: {0}'.format(page['url']))
-        if file_path not in files_xssed:
+            return None
+        if file_path.startswith('full/') and file_path[5:] in self.files_xssed:
+            return self.path_xssed + file_path[5:]
+        return None
+
+    def report_missing(self, source, page, file_path):
+        self.missing[source] += 1
+        if self.report is not None:
+            self.report.writerow([source, page['url'], file_path])
+
+def tasks_randomwalk(data_rw, index, verbose = True):
+    """
+    Generator of the (class, url, file_path) tuples of the benign pages listed
+    in data_rw that are available in index (a CorpusIndex)
+    """
+    for page in data_rw:
+        file_path = index.randomwalk_path(page)
+        if file_path is None:
+            if verbose:
+                index.report_missing('randomwalk', page, page['file_path'])
             continue
-        if page['category'] not in ['XSS', 'Script Insertion']:
+        yield (0, page['url'], file_path) # benign
+
+def tasks_xssed(data_xssed, index, verbose = True):
+    """
+    Generator of the (class, url, file_path) tuples of the malicious pages
+    listed in data_xssed that are available in index (a CorpusIndex)
+    """
+    for page in data_xssed:
+        file_path = index.xssed_path(page)
+        if file_path is None:
+            if verbose:
+                if not page['files']:
+                    print('[INFO] skipping xss: {0}'.format(page['url']))
+                index.report_missing('xssed', page, 
+                    page['files'][0]['path'] if page['files'] else '')
+            continue
+        if page['category'] not in ['XSS', 'Script Insertion'] and verbose:
             print('''Warning: non-XSS vuln imported. please check if it should
             be removed: {0}'''.format(page['url']))
-        feature_class = {'class': 1} # xss
-        features_url = parse_url(page['url'])
-        features_html = parse_html_file('html/xssed/'+file_path)
-        if features_html is None: # file not found, do not write
-            continue
-        features_page = {**feature_class, **features_url, **features_html} # merge dicts
-        data.append(features_page)
-        if i % 20 == 0:
-            printProgressBar(i + 1, number_pages_total, prefix = 'Progress malicious:',
-                suffix = 'Complete', length = 50)
-    write_csv(data, '../data.csv')
+        yield (1, page['url'], file_path) # xss
+
+def extract_page(task, parser = 'html5lib', cache_path = None, 
+        js_cache_size = 0, js_cache_disk = False, budget = None):
+    """
+    Input a (class, url, file_path) tuple, outputs a tuple of the dict of 
+    features of the page (or None if the HTML file cannot be found) and of the
+    counters of the extraction (see counters).
+    Defined at the module level to be picklable by multiprocessing.
+    """
+    counters.clear()
+    start = time.perf_counter()
+    page_class, url, file_path = task
+    cache = None
+    if cache_path is not None:
+        cache = open_cache(cache_path, getpid())
+    js_cache = None
+    if js_cache_size > 0:
+        js_cache = open_js_cache(js_cache_size, 
+            cache_path if js_cache_disk else None, getpid())
+    features_html = parse_html_file(file_path, parser = parser, cache = cache,
+        js_cache = js_cache, budget = budget)
+    if features_html is None: # file not found, do not write
+        return None, dict(counters)
+    with timer('url'):
+        features_url = parse_url(url)
+    counters['seconds_page'] = time.perf_counter() - start
+    # merge dicts
+    return {'class': page_class, **features_url, **features_html}, dict(counters)
+
+def extract_pages(tasks, workers = 1, window = 16, **options):
+    """
+    Generator of the results of extract_page over tasks (an iterable), in the 
+    same order as tasks. If workers > 1, pages are parsed by a pool of worker
+    processes. Results are streamed back in order, so the output is identical 
+    to the serial run. At most window * workers tasks are sent to the pool in
+    advance, so the memory used doesn't depend on the number of tasks.
+    options are passed to extract_page.
+    """
+    extract = partial(extract_page, **options)
+    if workers <= 1:
+        yield from map(extract, tasks)
+    else:
+        with Pool(workers) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(extract, (task,)))
+                if len(pending) >= window * workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+def parse_shard(string):
+    """
+    Parses the value of --shard: 'i/N' to the tuple (i, N), with 0 <= i < N
+    """
+    try:
+        shard, shards = (int(i) for i in string.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected i/N, ex: 0/4')
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError('expected 0 <= i < N')
+    return shard, shards
+
+def shard_tasks(tasks, shard, shards, skip = 0):
+    """
+    Generator of the (position, task) tuples of the shard-th of shards slices
+    of tasks: the tasks whose position in tasks modulo shards is shard, 
+    except the first skip ones of the slice. The slices are deterministic for 
+    the same feeds, and balanced.
+    """
+    for position, task in enumerate(tasks):
+        if position % shards == shard:
+            if skip > 0:
+                skip -= 1
+                continue
+            yield position, task
+
+def shard_paths(output, shard, shards):
+    """
+    Returns the paths of the CSV file and of the manifest of shard (among
+    shards) for the final output file output
+    """
+    prefix = '{0}.shard-{1}-of-{2}'.format(splitext(output)[0], shard, shards)
+    return prefix + '.csv', prefix + '.json'
+
+class ShardOutput(object):
+    """
+    Output of the shard-th of shards slices of the corpus (see --shard): a 
+    CSV file of its rows, and a JSON manifest that describes the shard and 
+    checkpoints its progress: the number of tasks done, the position of each
+    row in the unsharded output (to merge the shards in the same order), and
+    the size of the CSV file at the checkpoint.
+    If a manifest of a previous run with the same settings is found, the 
+    shard resumes from its last checkpoint: the rows written after it are
+    discarded, and tasks_done tasks can be skipped.
+    """
+    def __init__(self, output, shard, shards, settings, 
+            checkpoint_every = 100):
+        self.path_csv, self.path_manifest = shard_paths(output, shard, shards)
+        self.checkpoint_every = checkpoint_every
+        self.manifest = {'shard': shard, 'shards': shards, 
+            'settings': settings, 'tasks_done': 0, 'positions': [], 
+            'csv_bytes': 0, 'complete': False}
+        self.resumed = False
+        if exists(self.path_manifest) and exists(self.path_csv):
+            with open(self.path_manifest, 'r') as f:
+                manifest = json.load(f)
+            if manifest['settings'] == settings:
+                self.manifest = manifest
+                self.resumed = True
+
+    @property
+    def tasks_done(self):
+        return self.manifest['tasks_done']
+
+    @property
+    def complete(self):
+        return self.manifest['complete']
+
+    def checkpoint(self, f):
+        """
+        Writes the manifest, after the rows written to f, atomically
+        """
+        f.flush()
+        fsync(f.fileno())
+        self.manifest['csv_bytes'] = fstat(f.fileno()).st_size
+        with open(self.path_manifest + '.tmp', 'w') as f_manifest:
+            json.dump(self.manifest, f_manifest)
+        replace(self.path_manifest + '.tmp', self.path_manifest)
+
+    def write(self, results):
+        """
+        Writes results, an iterable of (position, features or None) of the
+        tasks of the shard following the checkpoint, and checkpoints every 
+        checkpoint_every tasks
+        """
+        fieldnames = self.manifest['settings']['fieldnames']
+        if self.resumed:
+            # discard the rows written after the checkpoint
+            truncate(self.path_csv, self.manifest['csv_bytes'])
+            f = open(self.path_csv, 'a')
+        else:
+            f = open(self.path_csv, 'w')
+        with f:
+            writer = csv.DictWriter(f, fieldnames, 
+                quoting=csv.QUOTE_NONNUMERIC)
+            if not self.resumed:
+                writer.writeheader()
+            for i, (position, row) in enumerate(results):
+                if row is not None:
+                    writer.writerow(row)
+                    self.manifest['positions'].append(position)
+                self.manifest['tasks_done'] += 1
+                if (i + 1) % self.checkpoint_every == 0:
+                    self.checkpoint(f)
+            self.manifest['complete'] = True
+            self.checkpoint(f)
+
+def merge_shards(output, shards, output_format = 'csv'):
+    """
+    Merges the complete outputs of the shards (see ShardOutput) of output in
+    output, in the order of the unsharded run: the merged CSV file is 
+    identical to the one generated without --shard.
+    """
+    manifests = []
+    for shard in range(shards):
+        path_csv, path_manifest = shard_paths(output, shard, shards)
+        with open(path_manifest, 'r') as f:
+            manifest = json.load(f)
+        if not manifest['complete']:
+            raise ValueError('shard {0}/{1} is not complete'.format(shard, 
+                shards))
+        if manifests and manifest['settings'] != manifests[0]['settings']:
+            raise ValueError('shard {0}/{1} was generated with different '
+                'settings'.format(shard, shards))
+        manifests.append(manifest)
+    fieldnames = manifests[0]['settings']['fieldnames']
+    number_rows = sum(len(i['positions']) for i in manifests)
+    def shard_lines(shard, manifest):
+        # rows are written on a line, as all the features are numbers or 
+        # booleans
+        path_csv, _ = shard_paths(output, shard, shards)
+        with open(path_csv, 'r', newline='') as f:
+            f.readline() # header
+            lines = (f.readline() for _ in manifest['positions'])
+            yield from zip(manifest['positions'], lines)
+    lines = (line for _, line in heapq.merge(*(shard_lines(shard, 
+        manifest) for shard, manifest in enumerate(manifests))))
+    if output_format == 'npy':
+        values = {'True': True, 'False': False}
+        rows = (dict(zip(fieldnames, (values[i] if i in values else float(i)
+            for i in row))) for row in csv.reader(lines))
+        write_matrix(rows, splitext(output)[0], fieldnames, number_rows)
+    else:
+        with open(shard_paths(output, 0, shards)[0], 'r', newline='') as f:
+            header = f.readline()
+        with open(output, 'w', newline='') as f:
+            f.write(header)
+            f.writelines(lines)
+    print('[INFO] {0} shards merged: {1} rows'.format(shards, number_rows))
+
+def parse_args(args = None):
+    parser = argparse.ArgumentParser(description='Parse the HTML files '
+        'listed in randomwalk.json and xssed.json to generate ../data.csv')
+    parser.add_argument('--randomwalk', default='randomwalk.json',
+        help='feed of the randomwalk spider, as JSON or JSON Lines (default: '
+        'randomwalk.json)')
+    parser.add_argument('--xssed', default='xssed.json',
+        help='feed of the xssed spider, as JSON or JSON Lines (default: '
+        'xssed.json)')
+    parser.add_argument('--randomwalk-pages', 
+        default='html/randomsample/subsample/',
+        help='folder of the HTML files of the randomwalk spider, or PageStore '
+        '(default: html/randomsample/subsample/)')
+    parser.add_argument('--xssed-pages', default='html/xssed/full/',
+        help='folder of the HTML files of the xssed spider, or PageStore '
+        '(default: html/xssed/full/)')
+    parser.add_argument('--output', default='../data.csv',
+        help='CSV file to write (default: ../data.csv)')
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv',
+        help='csv (default), or npy to write the features as a NumPy matrix '
+        '(--output without extension + .npy), the labels (.labels.npy) and '
+        'the list of the columns (.columns.json)')
+    parser.add_argument('--missing', default=None,
+        help='CSV file listing the items of the feeds without HTML file')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+        help='i/N: only parse the i-th of N slices of the corpus (from 0), '
+        'to its own CSV file and manifest next to --output. An interrupted '
+        'shard resumes from its last checkpoint')
+    parser.add_argument('--checkpoint-every', type=int, default=100,
+        help='number of pages between the checkpoints of a shard (default: '
+        '100)')
+    parser.add_argument('--profile', default=None,
+        help='write the time spent per stage, the counters and the slowest '
+        'pages of the run to this JSON file')
+    parser.add_argument('--slowest', type=int, default=20,
+        help='number of slowest pages reported by --profile (default: 20)')
+    parser.add_argument('--cprofile', default=None,
+        help='profile the run with cProfile, and write the stats to this '
+        'file (see python3 -m pstats)')
+    parser.add_argument('--merge', type=int, default=None, metavar='N',
+        help='merge the outputs of the N shards to --output, and exit')
+    parser.add_argument('--workers', type=int, default=1, 
+        help='number of processes used to parse the pages (default: 1)')
+    parser.add_argument('--parser', choices=PARSERS, default='html5lib',
+        help='HTML parser backend (default: html5lib). See compare_parsers.py'
+        ' to check the differences of features between backends')
+    parser.add_argument('--cache', default='features_cache.sqlite',
+        help='SQLite file caching the features of the HTML files, to only '
+        'parse new or modified files (default: features_cache.sqlite)')
+    parser.add_argument('--no-cache', dest='cache', action='store_const',
+        const=None, help='do not use the cache')
+    parser.add_argument('--js-cache-size', type=int, default=65536,
+        help='number of JS codes whose features are kept in memory by each '
+        'process, 0 to disable (default: 65536)')
+    parser.add_argument('--js-cache-disk', action='store_true',
+        help='also store the features of JS codes in the --cache file, to '
+        'share them between processes and runs')
+    budget = parser.add_argument_group('budget', 'Limits of the cost of '
+        'parsing a page. Over budget, approximate features are computed and '
+        'the row is marked as degraded (new column)')
+    budget.add_argument('--max-html-bytes', type=int, default=None,
+        help='number of characters of a page used to build the DOM')
+    budget.add_argument('--max-seconds', type=float, default=None,
+        help='parsing time of a page, after which its JS codes are only '
+        'analysed lexically')
+    budget.add_argument('--max-script-bytes', type=int, default=None,
+        help='size of a JS code analysed by esprima')
+    budget.add_argument('--max-script-nodes', type=int, default=None,
+        help='number of nodes of the AST of a JS code')
+    return parser.parse_args(args)
+
+def iter_tasks(args, index, verbose = True):
+    """
+    Generator of the tasks of all the pages to parse: benign, then malicious
+    """
+    yield from tasks_randomwalk(iter_json(args.randomwalk), index, 
+        verbose = verbose)
+    yield from tasks_xssed(iter_json(args.xssed), index, verbose = verbose)
+
+def profile_report(total_counters, slowest, seconds, workers):
+    """
+    Returns the profile of a run as a dict: its duration, the time spent in 
+    each stage of the extraction (summed over the worker processes, sorted by
+    time), the counters (documents, scripts parsed, esprima errors, bytes 
+    read, etc.) and the slowest pages, a heap of (seconds, position, 
+    file_path, url) tuples
+    """
+    stages = {key[len('seconds_'):]: value for key, value in 
+        total_counters.items() if key.startswith('seconds_') and 
+        key != 'seconds_page'}
+    return {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'seconds': seconds,
+        'workers': workers,
+        'pages': total_counters['documents'] + total_counters['cache_hits'],
+        'stages': dict(sorted(stages.items(), key=lambda i: i[1], 
+            reverse=True)),
+        'counters': {key: value for key, value in sorted(
+            total_counters.items()) if not key.startswith('seconds_')},
+        'slowest': [{'seconds': page_seconds, 'file_path': file_path, 
+            'url': url} for page_seconds, _, file_path, url in 
+            sorted(slowest, reverse=True)],
+    }
+
+def main(args = None):
+    args = parse_args(args)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, 
+        format='%(message)s')
+    if args.merge is not None:
+        merge_shards(args.output, args.merge, args.format)
+        return
+    total_counters = Counter()
+    budget = Budget(args.max_html_bytes, args.max_seconds, 
+        args.max_script_bytes, args.max_script_nodes)
+    if budget == Budget():
+        budget = None
+    if args.cache is not None:
+        pruned = open_cache(args.cache, getpid()).prune()
+        if pruned:
+            print('[INFO] {0} outdated entries removed from the cache'.format(
+                pruned))
+    index = CorpusIndex(args.randomwalk_pages, args.xssed_pages)
+    fieldnames = feature_names(degraded = budget is not None)
+    shard, shards, skip = 0, 1, 0
+    if args.shard is not None:
+        shard, shards = args.shard
+        # the shard can only be resumed with the same settings and feeds
+        settings = {'fieldnames': fieldnames, 'parser': args.parser, 
+            'budget': budget and list(budget), 
+            'extractor_version': extractor_version(),
+            'feeds': {i: getsize(i) for i in (args.randomwalk, args.xssed)}}
+        shard_output = ShardOutput(args.output, shard, shards, settings, 
+            args.checkpoint_every)
+        if shard_output.complete:
+            print('[INFO] shard {0}/{1} is already complete'.format(shard, 
+                shards))
+            return
+        skip = shard_output.tasks_done
+        if skip:
+            print('[INFO] resuming shard {0}/{1} after {2} pages'.format(
+                shard, shards, skip))
+    # the feeds are read twice to avoid storing the tasks in memory
+    number_pages_total = sum(1 for _ in shard_tasks(iter_tasks(args, index, 
+        verbose = False), shard, shards, skip))
+    # Initial call to print 0% progress
+    printProgressBar(0, number_pages_total, prefix = 'Progress:', 
+        suffix = 'Complete', length = 50)
+    # (seconds, position, file_path, url) of the slowest pages, see --profile
+    slowest = []
+    def results():
+        # (position, task) of the tasks sent to extract_pages, in order
+        positions = deque()
+        def tasks():
+            for position, task in shard_tasks(iter_tasks(args, index), 
+                    shard, shards, skip):
+                positions.append((position, task))
+                yield task
+        results = extract_pages(tasks(), args.workers, 
+            parser = args.parser, cache_path = args.cache, 
+            js_cache_size = args.js_cache_size, 
+            js_cache_disk = args.js_cache_disk and args.cache is not None,
+            budget = budget)
+        for i, (features_page, page_counters) in enumerate(results):
+            total_counters.update(page_counters)
+            position, (_, url, file_path) = positions.popleft()
+            if args.profile is not None and features_page is not None:
+                page = (page_counters['seconds_page'], position, file_path, 
+                    url)
+                if len(slowest) < args.slowest:
+                    heapq.heappush(slowest, page)
+                else:
+                    heapq.heappushpop(slowest, page)
+            # time spent by the writer to consume the row
+            start = time.perf_counter()
+            yield position, features_page
+            total_counters['seconds_write'] += time.perf_counter() - start
+            if i % 20 == 0 or i + 1 == number_pages_total:
+                printProgressBar(i + 1, number_pages_total, 
+                    prefix = 'Progress:', suffix = 'Complete', length = 50)
+    def rows():
+        for _, features_page in results():
+            if features_page is not None:
+                yield features_page
+    if args.shard is not None:
+        write = lambda: shard_output.write(results())
+    elif args.format == 'npy':
+        write = lambda: write_matrix(rows(), splitext(args.output)[0], 
+            fieldnames, number_pages_total)
+    else:
+        write = lambda: write_csv(rows(), args.output, fieldnames)
+    if args.cprofile is not None:
+        if args.workers > 1:
+            print('[INFO] only the main process is profiled, use --workers 1 '
+                'to profile the parsing')
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    if args.missing is None:
+        write()
+    else:
+        with open(args.missing, 'w') as f:
+            index.report = csv.writer(f)
+            index.report.writerow(['source', 'url', 'file_path'])
+            write()
+    seconds = time.perf_counter() - start
+    if args.cprofile is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    for source, number in index.missing.items():
+        print('[INFO] {0} {1} items without HTML file'.format(number, source))
+    if args.cache is not None:
+        print('[INFO] cache: {0} hits, {1} misses'.format(
+            total_counters['cache_hits'], total_counters['cache_misses']))
+    if budget is not None:
+        print('[INFO] {0} degraded pages, {1} degraded JS codes'.format(
+            total_counters['degraded_documents'], 
+            total_counters['degraded_scripts']))
+    if args.profile is not None:
+        report = profile_report(total_counters, slowest, seconds, 
+            args.workers)
+        print('[INFO] time per stage: {0}'.format(', '.join(
+            '{0} {1:.1f}s'.format(stage, stage_seconds) for stage, 
+            stage_seconds in report['stages'].items())))
+        with open(args.profile, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.js_cache_size > 0:
+        js_calls = (total_counters['js_cache_hits'] + 
+            total_counters['js_cache_disk_hits'] + 
+            total_counters['js_cache_misses'])
+        # no JS code parsed: all the pages were read from the FeatureCache
+        hit_rate = 'n/a' if js_calls == 0 else '{0:.1%}'.format(
+            1 - total_counters['js_cache_misses'] / js_calls)
+        print('[INFO] JS cache: {0} hits, {1} disk hits, {2} misses ({3} '
+            'hit rate), {4} evictions'.format(total_counters['js_cache_hits'],
+            total_counters['js_cache_disk_hits'], 
+            total_counters['js_cache_misses'], hit_rate,
+            total_counters['js_cache_evictions']))
 
 if __name__ == "__main__":
     main()
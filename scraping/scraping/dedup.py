@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import re
+import numpy as np
+from hashlib import sha1, blake2b
+from scraping.urlstore import URLStore
+
+# Detection of the duplicated pages during the random walk (see
+# spiders/randomwalk.py), so they are never written to disk, nor counted in
+# CLOSESPIDER_ITEMCOUNT.
+# - exact duplicates: the sha1 of the contents of the pages are stored in a
+#   URLStore (a persistent set of strings)
+# - near duplicates (optional): pages whose SimHash (Charikar, 2002) differs
+#   by at most max_distance bits from the SimHash of a stored page. Ex: the
+#   same page with tracking parameters, timestamps or session ids.
+#   To find them without comparing all the pairs, the 64 bits are split in
+#   max_distance + 1 blocks: two SimHashes at distance <= max_distance have
+#   at least one identical block (pigeonhole principle), so only the
+#   SimHashes sharing a block with the page are compared.
+# The spider computes the SimHash of the pages in the thread pool of the
+# reactor: only the lookups and the insertions run in the reactor thread.
+
+TOKEN = re.compile(rb'\w+')
+
+def simhash(body, shingle=3):
+    """ Input the content of a page as bytes, output its 64-bit SimHash,
+    computed on the shingles of shingle tokens (words and tag names) """
+    tokens = TOKEN.findall(body.lower())
+    if len(tokens) < shingle:
+        tokens = [b' '.join(tokens)]
+    else:
+        tokens = [b' '.join(tokens[i:i + shingle])
+            for i in range(len(tokens) - shingle + 1)]
+    hashes = np.frombuffer(b''.join(blake2b(token, digest_size=8).digest()
+        for token in tokens), dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1,
+        bitorder='little')
+    # majority vote of each bit
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) > len(tokens)
+    return int.from_bytes(np.packbits(votes, bitorder='little').tobytes(),
+        'little')
+
+class SimHashIndex(object):
+    """ Set of 64-bit SimHashes, to find the ones at Hamming distance at most
+    max_distance of a SimHash. If path is not None, the SimHashes are also
+    appended to this file (and loaded from it if it exists) """
+
+    def __init__(self, max_distance=3, path=None):
+        self.max_distance = max_distance
+        # split the 64 bits in max_distance + 1 blocks
+        number_blocks = max_distance + 1
+        size = 64 // number_blocks
+        self.blocks = [(i * size, 64 if i == number_blocks - 1 else
+            (i + 1) * size) for i in range(number_blocks)]
+        self.tables = [{} for _ in self.blocks]
+        self.file = None
+        if path is not None:
+            self.file = URLStore(path)
+            for line in self.file:
+                self.index(int(line, 16))
+
+    def keys(self, value):
+        for start, end in self.blocks:
+            yield (value >> start) & ((1 << (end - start)) - 1)
+
+    def find(self, value):
+        """ Returns a stored SimHash at distance at most max_distance of
+        value, or None """
+        for table, key in zip(self.tables, self.keys(value)):
+            for candidate in table.get(key, ()):
+                if bin(candidate ^ value).count('1') <= self.max_distance:
+                    return candidate
+        return None
+
+    def index(self, value):
+        for table, key in zip(self.tables, self.keys(value)):
+            table.setdefault(key, []).append(value)
+
+    def add(self, value):
+        self.index(value)
+        if self.file is not None:
+            self.file.append('{0:016x}'.format(value))
+
+class DuplicateFilter(object):
+    """ Index of the contents of the pages saved by the spider. is_duplicate
+    checks if a page is an exact duplicate (or a near duplicate, if
+    max_distance is not None) of a page already seen, and otherwise adds it to
+    the index. If path is not None, the index is persistent: stored in
+    path.sha1 (and path.simhash) and loaded from them if they exist """
+
+    def __init__(self, path=None, max_distance=None):
+        self.hashes = URLStore(None if path is None else path + '.sha1')
+        self.simhashes = None
+        if max_distance is not None:
+            self.simhashes = SimHashIndex(max_distance,
+                None if path is None else path + '.simhash')
+
+    def is_duplicate(self, body, value=None):
+        """ Input the content of a page as bytes, output 'exact' or 'near' if
+        the page is a duplicate, None otherwise (the page is then indexed).
+        value is the SimHash of body, if already computed (ex: in a thread,
+        as it is much slower than the lookups) """
+        digest = sha1(body).hexdigest()
+        if digest in self.hashes:
+            return 'exact'
+        if self.simhashes is not None:
+            if value is None:
+                value = simhash(body)
+            if self.simhashes.find(value) is not None:
+                return 'near'
+            self.simhashes.add(value)
+        self.hashes.append(digest)
+        return None
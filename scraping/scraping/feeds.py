@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+
+# Reader of the feeds of the spiders (scrapy -o items.json, or -o items.jl),
+# used by generate_data.py and by the tools of the spiders (linkgraph.py,
+# mirrorindex.py).
+
+# separators between the items of a JSON list or of a JSON Lines file
+JSON_SEPARATORS = re.compile(r'[\s,\[\]]*')
+
+def iter_json(filename, chunk_size=1 << 20):
+    """ Generator of the items of filename, a JSON file containing a list of 
+    objects (scrapy -o items.json) or a JSON Lines file (scrapy -o items.jl). 
+    The file is read by chunks, so the memory used doesn't depend on its 
+    size. """
+    decoder = json.JSONDecoder()
+    with open(filename, 'r') as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+        position = 0
+        while True:
+            position = JSON_SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                if eof:
+                    return
+                buffer = f.read(chunk_size)
+                eof = not buffer
+                position = 0
+                continue
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # the item is not entirely in the buffer
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
@@ -24,3 +24,5 @@ class xssedItem(scrapy.Item):
 class randomWalkItem(scrapy.Item):
     url = scrapy.Field()
     file_path = scrapy.Field()
+    body = scrapy.Field() # content of the page, written to file_path and 
+    # removed by PageWriterPipeline
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from scraping.urlstore import fingerprint
+from scraping.feeds import iter_json
+
+# Inverse-PageRank sampling of the pages of the random walk (see
+# spiders/randomwalk.py), as described by Henzinger et al. (2000): the walk
+# visits the pages with a probability close to their PageRank, so including
+# each page in the final sample with a probability proportional to the inverse
+# of its PageRank gives a near-uniform sample of the Web.
+# - the spider records the links of each page in a LinkGraph: an append-only
+#   file of (source, target) pairs of 64-bit fingerprints of the URLs (16
+#   bytes per edge)
+# - pagerank loads the edges as NumPy arrays, renumbers the URLs, builds the
+#   CSR matrix of the incoming links and runs the power iteration, vectorized:
+#   memory is O(number of edges), and millions of edges take seconds
+# - inverse_pagerank_sample draws the sample, without replacement, with
+#   weights 1 / PageRank
+
+EDGE = np.dtype([('source', '<u8'), ('target', '<u8')])
+
+class LinkGraph(object):
+    """ Append-only store of the links between the pages, in the file path.
+    If path already exists, the new links are appended to it. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        # ignore a partially written edge
+        size = os.path.getsize(path)
+        if size % EDGE.itemsize:
+            self.file.truncate(size - size % EDGE.itemsize)
+
+    def add(self, url, links):
+        """ Records the links (a list of URLs) of the page url """
+        if not links:
+            return
+        edges = np.empty(len(links), dtype=EDGE)
+        edges['source'] = fingerprint(url)
+        edges['target'] = [fingerprint(link) for link in links]
+        self.file.write(edges.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def load_edges(path):
+    """ Returns the (sources, targets) arrays of fingerprints of the edges
+    stored in path by a LinkGraph (memory mapped) """
+    size = os.path.getsize(path) // EDGE.itemsize
+    if size == 0:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty
+    edges = np.memmap(path, dtype=EDGE, mode='r', shape=(size,))
+    return edges['source'], edges['target']
+
+def renumber(values):
+    """ Returns (unique, ids): the sorted unique values of the array values,
+    and the index in unique of each value (like np.unique with
+    return_inverse, which is much slower on large arrays of integers) """
+    order = np.argsort(values)
+    values = values[order]
+    first = np.empty(len(values), dtype=bool)
+    first[:1] = True
+    np.not_equal(values[1:], values[:-1], out=first[1:])
+    ids = np.empty(len(values), dtype=np.int64)
+    ids[order] = np.cumsum(first) - 1
+    return values[first], ids
+
+def build_csr(sources, targets):
+    """ Input the arrays of fingerprints of the edges, output (nodes, indptr,
+    indices, out_degree): the sorted fingerprints of the nodes, and the CSR
+    matrix of the incoming links (the sources of the links to nodes[i] are
+    nodes[indices[indptr[i]:indptr[i + 1]]]). Duplicated links and links to
+    the same page are removed. """
+    nodes, ids = renumber(np.concatenate([sources, targets]))
+    n = len(nodes)
+    source_ids, target_ids = ids[:len(sources)], ids[len(sources):]
+    # sort by target (then source), and remove the duplicates
+    keys, _ = renumber(target_ids * n + source_ids)
+    target_ids, source_ids = np.divmod(keys, n)
+    keep = target_ids != source_ids
+    target_ids, source_ids = target_ids[keep], source_ids[keep]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(target_ids, minlength=n), out=indptr[1:])
+    out_degree = np.bincount(source_ids, minlength=n)
+    return nodes, indptr, source_ids, out_degree
+
+def pagerank(indptr, indices, out_degree, damping=0.85, tol=1e-10,
+        max_iter=200):
+    """ Returns the PageRank of the nodes of the CSR matrix of incoming links
+    (see build_csr), computed by power iteration until the L1 change is below
+    tol. The rank of the pages without links (dangling) is distributed
+    uniformly. """
+    n = len(out_degree)
+    if n == 0:
+        return np.empty(0)
+    dangling = out_degree == 0
+    inverse_degree = np.zeros(n)
+    inverse_degree[~dangling] = 1. / out_degree[~dangling]
+    rank = np.full(n, 1. / n)
+    sums = np.zeros(len(indices) + 1)
+    for _ in range(max_iter):
+        # sum of rank / out_degree of the sources of the incoming links of
+        # each node: difference of the cumulative sum at the bounds of the row
+        np.cumsum((rank * inverse_degree)[indices], out=sums[1:])
+        new_rank = sums[indptr[1:]] - sums[indptr[:-1]]
+        new_rank *= damping
+        new_rank += (damping * rank[dangling].sum() + 1. - damping) / n
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tol:
+            break
+    return rank / rank.sum()
+
+def url_ranks(urls, nodes, rank):
+    """ Returns the PageRank of each URL of urls. URLs not in the graph get
+    the minimum rank """
+    keys = np.array([fingerprint(url) for url in urls], dtype=np.uint64)
+    ranks = np.full(len(keys), rank.min() if len(rank) else 1.)
+    if len(nodes):
+        positions = np.minimum(np.searchsorted(nodes, keys), len(nodes) - 1)
+        found = nodes[positions] == keys
+        ranks[found] = rank[positions[found]]
+    return ranks
+
+def inverse_pagerank_sample(ranks, size, seed=None):
+    """ Returns the indices of a sample of size elements, drawn without
+    replacement, each with a probability proportional to 1 / ranks """
+    weights = 1. / np.asarray(ranks, dtype=np.float64)
+    size = min(size, len(weights))
+    rng = np.random.default_rng(seed)
+    # weighted sampling without replacement (Efraimidis and Spirakis, 2006):
+    # the size largest keys u ** (1 / weight)
+    keys = np.log(rng.random(len(weights))) / weights
+    return np.sort(np.argpartition(-keys, size - 1)[:size]) if size else \
+        np.empty(0, dtype=np.int64)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='PageRank of the pages of '
+        'the random walk, and inverse-PageRank sampling (see '
+        'scraping/linkgraph.py)')
+    parser.add_argument('graph', help='file of the links (LINK_GRAPH_PATH)')
+    parser.add_argument('feed', help='feed of the randomwalk spider (JSON or '
+        'JSON Lines)')
+    parser.add_argument('--size', type=int, default=None,
+        help='number of pages to sample. If not set, the PageRank of the '
+        'pages of the feed are written instead')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--damping', type=float, default=0.85)
+    parser.add_argument('--output', default=None,
+        help='JSON Lines file to write (default: stdout)')
+    args = parser.parse_args(args)
+    sources, targets = load_edges(args.graph)
+    nodes, indptr, indices, out_degree = build_csr(sources, targets)
+    print('[INFO] {0} pages, {1} links'.format(len(nodes), len(indices)),
+        file=sys.stderr)
+    rank = pagerank(indptr, indices, out_degree, args.damping)
+    items = list(iter_json(args.feed))
+    ranks = url_ranks([item['url'] for item in items], nodes, rank)
+    if args.size is not None:
+        selected = inverse_pagerank_sample(ranks, args.size, args.seed)
+    else:
+        selected = range(len(items))
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    for i in selected:
+        output.write(json.dumps(dict(items[i], pagerank=float(ranks[i])))
+            + '\n')
+    if args.output is not None:
+        output.close()
+        print('[INFO] {0} pages written to {1}'.format(len(selected),
+            args.output), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,10 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from collections import deque
+from urllib.parse import urlparse
+from scrapy import signals, Request
+from scrapy.exceptions import NotConfigured
 
 
 class ScrapingSpiderMiddleware(object):
@@ -54,3 +57,155 @@ class ScrapingSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class WalkTrapMiddleware(object):
+    """
+    Detects the walks of RandomWalkSpider trapped in a loop, or in a domain
+    whose pages were already saved (calendars, faceted search, etc.), and
+    forces a random jump instead of following one more link:
+    - cycle: the page was already visited by the walk in its last 
+      TRAP_CYCLE_LENGTH pages
+    - low novelty: the walk visited at least TRAP_DOMAIN_PAGES pages in a row 
+      in the same domain, and less than TRAP_MIN_NOVELTY of them were saved
+    The number of forced jumps is stored in the stats (trap/*).
+    """
+
+    def __init__(self, stats, cycle_length=8, domain_pages=10, 
+            min_novelty=0.2):
+        self.stats = stats
+        self.cycle_length = cycle_length
+        self.domain_pages = domain_pages
+        self.min_novelty = min_novelty
+        self.history = {} # walk -> deque of its last URLs
+        self.domains = {} # walk -> [domain, pages, saved pages]
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(crawler.stats, settings.getint('TRAP_CYCLE_LENGTH', 8),
+            settings.getint('TRAP_DOMAIN_PAGES', 10),
+            settings.getfloat('TRAP_MIN_NOVELTY', 0.2))
+
+    def process_spider_output(self, response, result, spider):
+        return self.check(response, list(result), spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        for i in self.check(response, [i async for i in result], spider):
+            yield i
+
+    def check(self, response, result, spider):
+        """ Returns result, the output of the spider for response, where the
+        next request of the walk is replaced by a random jump if the walk is
+        trapped """
+        walk = response.meta.get('walk')
+        # novel is set by the spider when the walk continues from this page
+        novel = response.meta.get('novel')
+        if walk is None or novel is None:
+            return result
+        trap = self.detect(walk, response.url, novel)
+        if trap is None:
+            return result
+        self.stats.inc_value('trap/' + trap)
+        spider.logger.debug('Walk %d trapped (%s) at %s. Random jump' 
+            % (walk, trap, response.url))
+        self.history.pop(walk, None)
+        self.domains.pop(walk, None)
+        return [spider.random_jump(walk) if isinstance(i, Request) and 
+            i.meta.get('walk') == walk else i for i in result]
+
+    def detect(self, walk, url, novel):
+        """ Records the visit of url by walk, returns 'cycle', 'low_novelty'
+        or None """
+        history = self.history.setdefault(walk, 
+            deque(maxlen=self.cycle_length))
+        cycle = url in history
+        history.append(url)
+        domain = urlparse(url).hostname
+        stats = self.domains.get(walk)
+        if stats is None or stats[0] != domain:
+            stats = self.domains[walk] = [domain, 0, 0]
+        stats[1] += 1
+        stats[2] += novel
+        if cycle:
+            return 'cycle'
+        if (stats[1] >= self.domain_pages and 
+                stats[2] < self.min_novelty * stats[1]):
+            return 'low_novelty'
+        return None
+
+
+class AdaptiveThrottleMiddleware(object):
+    """
+    Adapts the concurrency and the delay of each domain (downloader slot) to
+    its latency and errors, instead of the same DOWNLOAD_DELAY and 
+    CONCURRENT_REQUESTS_PER_DOMAIN for all the hosts. Additive increase, 
+    multiplicative decrease:
+    - a response faster than ADAPTIVE_THROTTLE_TARGET_LATENCY seconds 
+      increases the concurrency of its domain by 1 (up to 
+      ADAPTIVE_THROTTLE_MAX_CONCURRENCY) and decreases its delay by 10% (down
+      to DOWNLOAD_DELAY)
+    - a slower response decreases the concurrency by 1, and moves the delay
+      towards the latency
+    - an error (timeout, connection error, 429 or 5xx) halves the concurrency
+      and doubles the delay (up to ADAPTIVE_THROTTLE_MAX_DELAY)
+    Enabled by ADAPTIVE_THROTTLE_ENABLED.
+    """
+
+    ERROR_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, crawler, max_concurrency=8, target_latency=2., 
+            min_delay=0., max_delay=30.):
+        self.crawler = crawler
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        return cls(crawler, 
+            settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', 8),
+            settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', 2.),
+            settings.getfloat('DOWNLOAD_DELAY'),
+            settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 30.))
+
+    def slot(self, request):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None
+        return self.crawler.engine.downloader.slots.get(key)
+
+    def process_response(self, request, response, spider):
+        slot = self.slot(request)
+        latency = request.meta.get('download_latency')
+        if slot is None or latency is None:
+            return response
+        if response.status in self.ERROR_STATUSES:
+            self.decrease(slot, latency)
+        elif latency <= self.target_latency:
+            slot.concurrency = min(slot.concurrency + 1, self.max_concurrency)
+            slot.delay = max(slot.delay * 0.9, self.min_delay)
+            self.crawler.stats.inc_value('adaptive_throttle/increases')
+        else:
+            slot.concurrency = max(min(slot.concurrency, 
+                self.max_concurrency) - 1, 1)
+            slot.delay = min(max((slot.delay + latency) / 2, self.min_delay),
+                self.max_delay)
+            self.crawler.stats.inc_value('adaptive_throttle/slowdowns')
+        return response
+
+    def process_exception(self, request, exception, spider):
+        slot = self.slot(request)
+        if slot is not None:
+            self.decrease(slot, request.meta.get('download_latency', 0.))
+        return None
+
+    def decrease(self, slot, latency):
+        slot.concurrency = max(slot.concurrency // 2, 1)
+        slot.delay = min(max(slot.delay * 2, latency, self.min_delay, 0.1),
+            self.max_delay)
+        self.crawler.stats.inc_value('adaptive_throttle/decreases')
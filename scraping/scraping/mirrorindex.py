@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import argparse
+from scraping.feeds import iter_json
+
+# Index of the mirrors of xssed.com already crawled by the xssed spider (see
+# spiders/xssed.py), to refresh the malicious pages incrementally: the spider
+# doesn't request the mirrors of the index again, and stops browsing the
+# archive (newest first) once its pages only list known mirrors.
+# The index is a text file, one mirror per line: "id path checksum"
+# (tab-separated), where path and checksum are the ones of the file downloaded
+# by FilesPipeline (empty for the mirrors that are not XSS). The mirrors whose
+# download failed are not indexed, so that the next crawl retries them.
+
+class MirrorIndex(object):
+    """ Persistent index of the mirrors: id -> (path, checksum). The mirrors
+    are appended to the file path, and loaded from it if it exists. """
+
+    def __init__(self, path):
+        self.path = path
+        self.mirrors = {}
+        end = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break # last mirror partially written
+                    mirror_id, file_path, checksum = \
+                        line[:-1].decode().split('\t')
+                    self.mirrors[mirror_id] = (file_path, checksum)
+                    end += len(line)
+        self.file = open(path, 'ab')
+        self.file.truncate(end)
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def __contains__(self, mirror_id):
+        return mirror_id in self.mirrors
+
+    def get(self, mirror_id):
+        """ Returns the (path, checksum) of the file of the mirror, or None if
+        it is not in the index """
+        return self.mirrors.get(mirror_id)
+
+    def add(self, mirror_id, file_path='', checksum=''):
+        self.mirrors[mirror_id] = (file_path, checksum)
+        self.file.write('{0}\t{1}\t{2}\n'.format(mirror_id, file_path,
+            checksum).encode())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def mirror_id(url):
+    """ Returns the id of a mirror from its URL (ex: 78538 for
+    http://www.xssed.com/mirror/78538/) """
+    return url.rstrip('/').split('/')[-1]
+
+def build(feed, path):
+    """ Adds the items of a feed of the xssed spider to the index path.
+    Returns the number of mirrors added """
+    index = MirrorIndex(path)
+    number = 0
+    for item in iter_json(feed):
+        files = item.get('files')
+        if item['id'] in index or not files:
+            continue # download failed: retried by the next crawl
+        index.add(item['id'], files[0]['path'], files[0]['checksum'])
+        number += 1
+    index.close()
+    return number
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build the index of the '
+        'mirrors of a previous crawl of the xssed spider, to refresh it '
+        'incrementally (see scraping/mirrorindex.py)')
+    parser.add_argument('feed', help='feed of the xssed spider (JSON or JSON '
+        'Lines)')
+    parser.add_argument('index', help='index to create or update '
+        '(XSSED_INDEX_PATH)')
+    args = parser.parse_args(args)
+    number = build(args.feed, args.index)
+    print('[INFO] {0} mirrors added to {1}'.format(number, args.index))
+
+if __name__ == "__main__":
+    main()
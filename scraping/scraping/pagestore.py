@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import zlib
+import mmap
+import time
+import fcntl
+import random
+import argparse
+import threading
+
+# Store of the pages saved by the spiders, instead of one file per page (sha1
+# names under html/xssed/full and html/randomsample/full): 150k+ small files
+# waste inodes and disk blocks, and make listdir, cp and the cold reads of
+# generate_data.py slow.
+# A PageStore is a folder containing:
+# - append-only segments (segment-00000.dat, ...) of at most segment_size
+#   bytes, where each page is compressed with zlib
+# - pages.index: one line per page, "key segment offset length raw_length
+#   mtime" (tab-separated), appended after the page was written in its
+#   segment. The index is loaded in a dict when the store is opened.
+# Pages are read through a mmap of their segment (random access, no open()
+# per page). A page stored twice under the same key is replaced: the last
+# line of the index wins. Deleted pages are marked in the index (segment -1);
+# their space is only reclaimed by packing the store into a new one.
+# Only one process can write to a store at a time (lock on the index).
+
+INDEX = 'pages.index'
+SEGMENT = 'segment-{0:05d}.dat'
+
+def is_page_store(path):
+    """ Input a folder, output True if it is a PageStore """
+    return os.path.isfile(os.path.join(path, INDEX))
+
+class PageStore(object):
+    """ Append-only store of pages (bytes) by key (the names of the files
+    that the spiders used to write: sha1 of the URL). mode is 'r' (read
+    only) or 'a' (read and append; the store is created if path doesn't
+    exist). API: len, in, iter (keys), get, put, sync, close. """
+
+    def __init__(self, path, mode='r', segment_size=1 << 30, level=6):
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'")
+        self.path = path
+        self.mode = mode
+        self.segment_size = segment_size
+        self.level = level
+        self.entries = {} # key -> (segment, offset, length, raw_length, mtime)
+        self.maps = {} # segment -> mmap
+        self.lock = threading.Lock()
+        self.index_end = 0 # size of the index loaded
+        self.segment = 0 # segment being written
+        self.segment_end = 0
+        self.segment_fd = None
+        self.index_fd = None
+        if mode == 'r':
+            if not is_page_store(path):
+                raise FileNotFoundError('No PageStore in {0}'.format(path))
+            self.refresh()
+            return
+        os.makedirs(path, exist_ok=True)
+        self.index_fd = os.open(os.path.join(path, INDEX),
+            os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.index_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.index_fd)
+            raise RuntimeError('PageStore {0} is already opened by another '
+                'writer'.format(path))
+        self.refresh()
+        # ignore a partially written line of the index, and the pages written
+        # after the last indexed one (the writer was interrupted)
+        os.truncate(self.index_fd, self.index_end)
+        os.lseek(self.index_fd, self.index_end, os.SEEK_SET)
+        if self.entries:
+            self.segment = max(i[0] for i in self.entries.values())
+            self.segment_end = max(i[1] + i[2] for i in
+                self.entries.values() if i[0] == self.segment)
+        self.open_segment(self.segment)
+
+    def refresh(self):
+        """ Loads the pages indexed since the store was opened (by another
+        process writing to it) """
+        with open(os.path.join(self.path, INDEX), 'rb') as f:
+            f.seek(self.index_end)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # last page being written
+                key, segment, offset, length, raw_length, mtime = \
+                    line[:-1].decode().split('\t')
+                if segment == '-1':
+                    self.entries.pop(key, None) # deleted
+                else:
+                    self.entries[key] = (int(segment), int(offset), 
+                        int(length), int(raw_length), float(mtime))
+                self.index_end += len(line)
+
+    def open_segment(self, segment):
+        if self.segment_fd is not None:
+            os.fsync(self.segment_fd)
+            os.close(self.segment_fd)
+        self.segment = segment
+        self.segment_fd = os.open(os.path.join(self.path,
+            SEGMENT.format(segment)), os.O_RDWR | os.O_CREAT, 0o644)
+        os.truncate(self.segment_fd, self.segment_end)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def info(self, key):
+        """ Returns the (segment, offset, length, raw_length, mtime) of the
+        page key. Raises KeyError if it is not in the store """
+        return self.entries[key]
+
+    def get(self, key):
+        """ Returns the content of the page key, as bytes. Raises KeyError if
+        it is not in the store """
+        segment, offset, length, _, _ = self.entries[key]
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + length:
+            # not mapped yet, or the segment grew since it was mapped
+            # (the old mmap is closed by the GC, once not read anymore)
+            with self.lock:
+                with open(os.path.join(self.path, SEGMENT.format(segment)),
+                        'rb') as f:
+                    segment_map = mmap.mmap(f.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+                self.maps[segment] = segment_map
+        with memoryview(segment_map)[offset:offset + length] as data:
+            return zlib.decompress(data)
+
+    def put(self, key, body):
+        """ Adds the page key, whose content is body (bytes), to the store.
+        Thread-safe: pages are compressed in the calling threads """
+        if self.mode != 'a':
+            raise ValueError('PageStore opened in read-only mode')
+        if not key or '\t' in key or '\n' in key:
+            raise ValueError('Invalid key: {0!r}'.format(key))
+        data = zlib.compress(body, self.level)
+        with self.lock:
+            if (self.segment_end > 0 and
+                    self.segment_end + len(data) > self.segment_size):
+                self.segment_end = 0
+                self.open_segment(self.segment + 1)
+            offset = self.segment_end
+            os.pwrite(self.segment_fd, data, offset)
+            self.segment_end += len(data)
+            entry = (self.segment, offset, len(data), len(body), time.time())
+            self.write_index(key, entry)
+            self.entries[key] = entry
+
+    def delete(self, key):
+        """ Removes the page key from the store. Raises KeyError if it is not
+        in the store """
+        if self.mode != 'a':
+            raise ValueError('PageStore opened in read-only mode')
+        with self.lock:
+            del self.entries[key]
+            self.write_index(key, (-1, 0, 0, 0, time.time()))
+
+    def write_index(self, key, entry):
+        line = '{0}\t{1}\t{2}\t{3}\t{4}\t{5:.3f}\n'.format(key,
+            *entry).encode()
+        os.write(self.index_fd, line)
+        self.index_end += len(line)
+
+    def sync(self):
+        """ Flushes the pages written and the index to the disk """
+        if self.mode != 'a':
+            return
+        with self.lock:
+            os.fsync(self.segment_fd)
+            os.fsync(self.index_fd)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self.mode == 'a' and self.index_fd is not None:
+            self.sync()
+            os.close(self.segment_fd)
+            os.close(self.index_fd) # releases the lock
+            self.index_fd = self.segment_fd = None
+        for segment_map in self.maps.values():
+            segment_map.close()
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def pack(sources, destination, sample=None, seed=None, segment_size=1 << 30):
+    """ Copies the pages of sources (folders of HTML files, or PageStores) to
+    the PageStore destination. If sample is not None, only a uniform random
+    sample of sample pages is copied (subsampling of the random walk) """
+    pages = [] # (source, key)
+    for source in sources:
+        if is_page_store(source):
+            pages += [(source, key) for key in PageStore(source).keys()]
+        else:
+            pages += [(source, name) for name in sorted(os.listdir(source))]
+    if sample is not None:
+        pages = random.Random(seed).sample(pages, min(sample, len(pages)))
+    stores = {}
+    with PageStore(destination, 'a', segment_size) as store:
+        for source, key in pages:
+            if is_page_store(source):
+                if source not in stores:
+                    stores[source] = PageStore(source)
+                body = stores[source].get(key)
+            else:
+                with open(os.path.join(source, key), 'rb') as f:
+                    body = f.read()
+            store.put(key, body)
+    for source_store in stores.values():
+        source_store.close()
+    return len(pages)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Manage the PageStores of '
+        'the spiders (see scraping/pagestore.py)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('pack', help='copy folders of HTML files '
+        '(or stores) to a store')
+    command.add_argument('sources', nargs='+')
+    command.add_argument('destination')
+    command.add_argument('--sample', type=int, default=None,
+        help='only copy a uniform random sample of SAMPLE pages')
+    command.add_argument('--seed', type=int, default=None)
+    command.add_argument('--segment-size', type=int, default=1 << 30,
+        help='maximum size of the segments, in bytes (default: 1GiB)')
+    command = commands.add_parser('ls', help='list the keys of a store')
+    command.add_argument('store')
+    command = commands.add_parser('cat', help='write a page to stdout')
+    command.add_argument('store')
+    command.add_argument('key')
+    command = commands.add_parser('stats', help='size of a store')
+    command.add_argument('store')
+    args = parser.parse_args(args)
+    if args.command == 'pack':
+        number = pack(args.sources, args.destination, args.sample, args.seed,
+            args.segment_size)
+        print('[INFO] {0} pages packed in {1}'.format(number,
+            args.destination))
+        return
+    with PageStore(args.store) as store:
+        if args.command == 'ls':
+            for key in store:
+                print(key)
+        elif args.command == 'cat':
+            sys.stdout.buffer.write(store.get(args.key))
+        else:
+            entries = store.entries.values()
+            raw = sum(i[3] for i in entries)
+            compressed = sum(i[2] for i in entries)
+            print('pages: {0}\nsegments: {1}\nraw bytes: {2}\ncompressed '
+                'bytes: {3}\nratio: {4:.2f}'.format(len(store),
+                len(set(i[0] for i in entries)), raw, compressed,
+                raw / compressed if compressed else 0.))
+
+if __name__ == "__main__":
+    main()
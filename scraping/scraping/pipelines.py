@@ -5,7 +5,309 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import threading
+import time
+import numpy as np
+from collections import deque
+from hashlib import md5
+from scrapy.exceptions import DropItem
+from scrapy.pipelines.files import FilesPipeline
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from scraping.pagestore import PageStore
+from scraping.sampling import ReservoirSampler
+
 
 class ScrapingPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+class PageWriterPipeline(object):
+    """
+    Writes the content of the pages (field body of the items) to their 
+    file_path in a pool of threads, so that the reactor thread is not blocked
+    by the disk. The body is removed from the item once written, before the
+    item is exported. At most PAGE_WRITER_MAX_PENDING pages are waiting to be
+    written: the other items wait (and so does the crawl, when CONCURRENT_ITEMS
+    is reached). Written files are fsynced by batches, every 
+    PAGE_WRITER_FSYNC_INTERVAL seconds (0 to disable), and when the spider is
+    closed. The number of files and bytes written and the latency of the 
+    writes are stored in the stats (page_writer/*).
+    If PAGE_STORE is set, the pages are added to this PageStore instead (see
+    pagestore.py), under the name of their file_path.
+    If RESERVOIR_SIZE is set, only a uniform random sample of RESERVOIR_SIZE
+    pages is kept (see ReservoirSampler, seeded by RESERVOIR_SEED): the pages
+    not sampled are not written, and the pages evicted from the sample are
+    deleted. The items of all the pages are still exported. When the spider
+    resumes a crawl (snapshot of WalkState, see spiders/randomwalk.py), the
+    sample is restored from the snapshot, and the pages of the URLs visited
+    since then (spider.visited_urls, spider.file_path) that are not in the 
+    sample are deleted.
+    """
+
+    def __init__(self, stats, threads=4, max_pending=16, fsync_interval=5.,
+            page_store=None, reservoir_size=None, reservoir_seed=None):
+        self.stats = stats
+        self.page_store = page_store
+        self.sampler = None
+        if reservoir_size is not None:
+            self.sampler = ReservoirSampler(reservoir_size, reservoir_seed)
+        self.writing = set() # paths being written
+        self.evict_after = set() # paths to delete once written
+        self.threads = threads
+        self.max_pending = max_pending
+        self.fsync_interval = fsync_interval
+        self.unsynced = [] # files written but not fsynced yet
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=100000)
+        self.crawler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        # strings when set with -s; unset or 0: no sampling
+        reservoir_size = settings.getint('RESERVOIR_SIZE') or None
+        reservoir_seed = settings.get('RESERVOIR_SEED')
+        if reservoir_seed is not None:
+            reservoir_seed = settings.getint('RESERVOIR_SEED')
+        pipeline = cls(crawler.stats, 
+            settings.getint('PAGE_WRITER_THREADS', 4),
+            settings.getint('PAGE_WRITER_MAX_PENDING', 16),
+            settings.getfloat('PAGE_WRITER_FSYNC_INTERVAL', 5.),
+            settings.get('PAGE_STORE'), reservoir_size, reservoir_seed)
+        pipeline.crawler = crawler
+        return pipeline
+
+    def open_spider(self, spider=None):
+        self.store = None
+        if self.page_store is not None:
+            self.store = PageStore(self.page_store, 'a')
+        if self.sampler is not None and self.crawler is not None:
+            # restored from, and saved in, the snapshots of the spider
+            spider = self.crawler.spider
+            self.resume_sample(spider)
+            spider.sampler = self.sampler
+        self.pool = ThreadPool(1, self.threads, name='PageWriter')
+        self.pool.start()
+        self.semaphore = DeferredSemaphore(self.max_pending)
+        self.fsync_loop = None
+        if self.fsync_interval > 0:
+            self.fsync_loop = LoopingCall(self.sync)
+            self.fsync_loop.start(self.fsync_interval, now=False)
+
+    def resume_sample(self, spider):
+        snapshot = getattr(spider, 'snapshot', None)
+        if snapshot is None:
+            return
+        if snapshot.get('reservoir') is None:
+            raise ValueError('Cannot resume the sample: the snapshot of the '
+                'crawl has no reservoir (RESERVOIR_SIZE was not set)')
+        self.sampler.setstate(snapshot['reservoir'])
+        # the pages saved after the snapshot are not in the restored sample:
+        # delete the ones that the killed crawl wrote (the URLs it visited 
+        # after the snapshot), not the other files of the folder
+        sample = set(self.sampler.sample)
+        removed = 0
+        for i in range(snapshot['visited'], len(spider.visited_urls)):
+            path = spider.file_path(spider.visited_urls[i])
+            if path in sample:
+                continue
+            if self.store is not None:
+                exists = os.path.basename(path) in self.store
+            else:
+                exists = os.path.exists(path)
+            if exists:
+                self.remove(path)
+                removed += 1
+        self.stats.set_value('reservoir/resumed_removed', removed)
+
+    async def process_item(self, item, spider=None):
+        if 'body' not in item:
+            return item
+        path = item['file_path']
+        evicted = None
+        if self.sampler is not None:
+            kept, evicted = self.sampler.offer(path)
+            if not kept:
+                self.stats.inc_value('reservoir/rejected')
+                del item['body']
+                return item
+        # before any await, so that an eviction of path while it waits (for
+        # the removal of the page it evicted, or for the semaphore) goes
+        # through evict_after
+        self.writing.add(path)
+        if evicted is not None:
+            self.stats.inc_value('reservoir/evicted')
+            if evicted in self.writing:
+                # waiting or being written: skipped or deleted after
+                self.evict_after.add(evicted)
+            else:
+                await maybe_deferred_to_future(self.in_thread(
+                    self.remove, evicted))
+        await maybe_deferred_to_future(self.semaphore.acquire())
+        if path in self.evict_after:
+            # evicted from the sample before being written
+            self.evict_after.discard(path)
+            self.writing.discard(path)
+            self.semaphore.release()
+            del item['body']
+            return item
+        start = time.perf_counter()
+        try:
+            await maybe_deferred_to_future(self.in_thread(self.write, 
+                path, item['body']))
+        except OSError as e:
+            self.evict_after.discard(path)
+            self.stats.inc_value('page_writer/errors')
+            raise DropItem('Cannot write {0}: {1}'.format(path, e))
+        finally:
+            self.writing.discard(path)
+            self.semaphore.release()
+        if path in self.evict_after:
+            # evicted from the sample while it was written
+            self.evict_after.discard(path)
+            await maybe_deferred_to_future(self.in_thread(self.remove, path))
+        self.latencies.append(time.perf_counter() - start)
+        self.stats.inc_value('page_writer/files')
+        self.stats.inc_value('page_writer/bytes', len(item['body']))
+        self.stats.max_value('page_writer/pending_max', 
+            self.max_pending - self.semaphore.tokens)
+        del item['body']
+        return item
+
+    def in_thread(self, function, *args):
+        from twisted.internet import reactor
+        return deferToThreadPool(reactor, self.pool, function, *args)
+
+    def write(self, path, body):
+        # runs in a thread of the pool
+        if self.store is not None:
+            self.store.put(os.path.basename(path), body)
+        else:
+            with open(path, 'wb') as f:
+                f.write(body)
+        with self.lock:
+            self.unsynced.append(path)
+
+    def remove(self, path):
+        # runs in a thread of the pool
+        try:
+            if self.store is not None:
+                self.store.delete(os.path.basename(path))
+            else:
+                os.remove(path)
+        except (KeyError, FileNotFoundError):
+            pass # its write failed
+
+    def sync(self):
+        return self.in_thread(self.fsync)
+
+    def fsync(self):
+        # runs in a thread of the pool
+        with self.lock:
+            paths, self.unsynced = self.unsynced, []
+        if self.store is not None:
+            if paths:
+                self.store.sync()
+                self.stats.inc_value('page_writer/fsync_batches')
+            return
+        folders = set()
+        for path in paths:
+            folders.add(os.path.dirname(path) or '.')
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue # evicted from the sample
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        # the entries of the new files
+        for folder in folders:
+            fd = os.open(folder, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if paths:
+            self.stats.inc_value('page_writer/fsync_batches')
+
+    async def close_spider(self, spider=None):
+        if self.fsync_loop is not None:
+            self.fsync_loop.stop()
+            await maybe_deferred_to_future(self.sync())
+        self.pool.stop()
+        if self.store is not None:
+            self.store.close()
+        if self.sampler is not None:
+            self.stats.set_value('reservoir/seen', self.sampler.seen)
+            self.stats.set_value('reservoir/kept', len(self.sampler))
+        if self.latencies:
+            p50, p99 = np.percentile(self.latencies, [50, 99])
+            self.stats.set_value('page_writer/latency_p50_ms', 
+                float(p50) * 1e3)
+            self.stats.set_value('page_writer/latency_p99_ms', 
+                float(p99) * 1e3)
+            self.stats.set_value('page_writer/latency_max_ms', 
+                max(self.latencies) * 1e3)
+
+
+class PageStoreFilesStore(object):
+    """
+    Storage of FilesPipeline in a PageStore (see pagestore.py), selected with
+    FILES_STORE = 'pagestore://<folder>'. The pages are stored under the name
+    of the file that FSFilesStore would write in full/ (sha1 of the URL).
+    """
+
+    def __init__(self, uri):
+        self.store = PageStore(uri.split('://', 1)[1], 'a')
+
+    def persist_file(self, path, buf, info, meta=None, headers=None):
+        self.store.put(os.path.basename(path), buf.getvalue())
+
+    def stat_file(self, path, info):
+        key = os.path.basename(path)
+        if key not in self.store:
+            return {}
+        return {'last_modified': self.store.info(key)[4],
+            'checksum': md5(self.store.get(key)).hexdigest()}
+
+
+class PageStoreFilesPipeline(FilesPipeline):
+    """
+    FilesPipeline that also accepts FILES_STORE = 'pagestore://<folder>'
+    """
+    STORE_SCHEMES = dict(FilesPipeline.STORE_SCHEMES,
+        pagestore=PageStoreFilesStore)
+
+    def close_spider(self, spider=None):
+        if isinstance(self.store, PageStoreFilesStore):
+            self.store.store.close()
+
+
+class MirrorIndexPipeline(object):
+    """
+    Adds the mirrors scraped by the xssed spider, and the path and checksum of
+    their file (downloaded by FilesPipeline), to the index of the spider (see
+    MirrorIndex), if the crawl is incremental. The mirrors whose file was not
+    downloaded are not added, so the next crawl requests them again.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_item(self, item, spider=None):
+        index = getattr(self.crawler.spider, 'mirror_index', None)
+        files = item.get('files')
+        if index is not None and files:
+            index.add(item['id'], files[0]['path'], files[0]['checksum'])
+        return item
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import random
+
+# Uniform random sample of the pages saved by the random walk, kept during the
+# crawl (see PageWriterPipeline): instead of saving all the pages and then
+# copying a subsample of them, only the pages of the sample are kept on disk.
+# Reservoir sampling (Vitter, 1985, algorithm R): the first size pages are
+# kept; then the n-th page replaces a random page of the sample with
+# probability size / n. At any time, the sample is a uniform random sample of
+# the pages seen so far.
+
+class ReservoirSampler(object):
+    """ Uniform random sample of at most size keys, among the keys offered
+    to it. With the same seed and the same sequence of keys, the sample is
+    the same. """
+
+    def __init__(self, size, seed=None):
+        if size <= 0:
+            raise ValueError('The size of the sample must be positive')
+        self.size = size
+        self.random = random.Random(seed)
+        self.sample = [] # keys of the sample
+        self.seen = 0 # number of keys offered
+
+    def __len__(self):
+        return len(self.sample)
+
+    def offer(self, key):
+        """ Offers key to the sample. Returns (kept, evicted): whether key is
+        added to the sample, and the key that it replaced (or None) """
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(key)
+            return True, None
+        i = self.random.randrange(self.seen)
+        if i >= self.size:
+            return False, None
+        evicted, self.sample[i] = self.sample[i], key
+        return True, evicted
+
+    def getstate(self):
+        """ Returns the state of the sampler (JSON serializable), to resume
+        the sampling with setstate """
+        return {'size': self.size, 'seen': self.seen, 'sample': self.sample,
+            'random': self.random.getstate()}
+
+    def setstate(self, state):
+        """ Restores a state returned by getstate """
+        if state['size'] != self.size:
+            raise ValueError('Cannot resume a sample of {0} keys with a size '
+                'of {1}'.format(state['size'], self.size))
+        version, internal, gauss = state['random']
+        self.random.setstate((version, tuple(internal), gauss))
+        self.sample = list(state['sample'])
+        self.seen = state['seen']
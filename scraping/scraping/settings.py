@@ -68,7 +68,8 @@ COOKIES_ENABLED = False
 #    'scraping.pipelines.ScrapingPipeline': 300,
 #}
 
-ITEM_PIPELINES = {'scrapy.pipelines.files.FilesPipeline': 1} # enables media pipeline
+ITEM_PIPELINES = {'scraping.pipelines.PageStoreFilesPipeline': 1} # enables media pipeline
+# FilesPipeline that also accepts FILES_STORE = 'pagestore://<folder>'
 FILES_STORE = 'html/'
 
 # Enable and configure the AutoThrottle extension (disabled by default)
@@ -2,6 +2,14 @@
 import scrapy
 import csv
 from scraping.items import randomWalkItem
+from scraping.urlstore import URLStore
+from scraping.dedup import DuplicateFilter, simhash
+from scraping.linkgraph import LinkGraph
+from scraping.walkstate import WalkState
+from scrapy import signals
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from random import choice, randint, sample
 from hashlib import sha1
 from urllib.parse import urldefrag
@@ -28,21 +36,28 @@ from urllib.parse import urldefrag
 # 3. Stop when we have saved CLOSESPIDER_ITEMCOUNT pages
 
 # Becareful:
-# 1. You have to filter out duplicated HTML pages after crawling. Even if the
-# spider strips out anchors in the URLs. Some URLs lead to the same page content
-# (eg. parameters used for tracking).
+# 1. Some URLs lead to the same page content (eg. parameters used for 
+# tracking), even if the spider strips out anchors in the URLs. Pages whose
+# content was already saved are not saved again, nor counted in 
+# CLOSESPIDER_ITEMCOUNT (see scraping/dedup.py). Set DEDUP_SIMHASH_DISTANCE
+# to also skip near-duplicated pages.
 # 2. Note that the URLs are canonicalized in order to removed duplicated links 
 # (eg. links to the same page having different fragments: foo#1, foo#2).
 # See http://w3lib.readthedocs.io/en/latest/w3lib.html#w3lib.url.canonicalize_url
 # 3. To fully implement the paper cited below, you have to compute the pageRank
 # of each page and include it in the final sample with a probability proportional
-# to the reverse of the page’s rank. THIS IS NOT DONE BY THIS SCRIPT.
+# to the reverse of the page’s rank. The spider records the links of the pages
+# in LINK_GRAPH_PATH; the PageRank and the sample are then computed by 
+# scraping/linkgraph.py.
 # 4. In order for the random walk method to work, we have to disable the 
 # filtering of duplicated requests. This means that the spider can be trapped in
 # a loop. But thanks to the random jumps, the walk will exit it after some time.
-# Then, you should avoid setting D_PROBABILITY to 0, and note that the spider 
-# may be using a lot of server ressources until the loop is existed. You can
-# configure DOWNLOAD_DELAY to avoid that.
+# Then, you should avoid setting D_PROBABILITY to 0. WalkTrapMiddleware also
+# forces a random jump when a walk comes back to a page it just visited, or
+# stays in a domain whose pages were already saved (see 
+# scraping/middlewares.py). AdaptiveThrottleMiddleware adapts the concurrency
+# and the delay of each domain to its latency and errors, to avoid using a lot
+# of server ressources.
 # See: https://doc.scrapy.org/en/latest/intro/tutorial.html?highlight=duplicated
 # And: https://doc.scrapy.org/en/latest/topics/settings.html#dupefilter-class
 
@@ -60,7 +75,8 @@ def import_seeds(URL_SEEDS_LIST, URL_SEEDS_CSV_PATH):
 
 def random_jump_url(URL_SEEDS, visited_urls):
     """Randomly choose one element between the 2 lists.
-       For performance the 2 lists are not joined.   """
+       For performance the 2 lists are not joined. visited_urls can be any
+       sequence with O(1) indexing, like URLStore.   """
     random_index = randint(0, len(URL_SEEDS)+len(visited_urls)-1)
     if random_index <= (len(URL_SEEDS)-1):
         return URL_SEEDS[random_index]
@@ -84,7 +100,48 @@ class RandomWalkSpider(scrapy.Spider):
         'CONCURRENT_REQUESTS': 50,
         'REACTOR_THREADPOOL_MAXSIZE': 20,
         'DOWNLOAD_TIMEOUT': 15,
-        'DOWNLOAD_MAXSIZE': 33554432 # do not download reponses bigger than 32MB 
+        'DOWNLOAD_MAXSIZE': 33554432, # do not download reponses bigger than 32MB 
+        'ITEM_PIPELINES': {'scraping.pipelines.PageWriterPipeline': 300},
+        # pages are written by a pool of threads (see PageWriterPipeline)
+        'PAGE_WRITER_THREADS': 4,
+        'PAGE_WRITER_MAX_PENDING': 16, # pages waiting to be written
+        'PAGE_WRITER_FSYNC_INTERVAL': 5, # seconds between 2 fsyncs of the 
+        # written pages
+        'PAGE_STORE': None, # if not None, folder of a PageStore (see 
+        # pagestore.py) where the pages are stored, instead of one file per 
+        # page in FILES_STORE. Ex: 'html/randomsample/store/'
+        'RESERVOIR_SIZE': None, # if not None nor 0, only keep a uniform 
+        # random sample of this number of pages (see ReservoirSampler). Set 
+        # CLOSESPIDER_ITEMCOUNT to the number of pages to crawl
+        'RESERVOIR_SEED': None, # seed of the random sample
+        'LINK_GRAPH_PATH': None, # if not None, file where the links of the 
+        # visited pages are recorded (see LinkGraph), to sample the pages with
+        # a probability inversely proportional to their PageRank
+        'WALK_STATE_PATH': None, # if not None, prefix of the files where the
+        # state of the walk is checkpointed (see WalkState). A crawl killed
+        # with the same WALK_STATE_PATH resumes from its last checkpoint
+        'WALK_STATE_INTERVAL': 60, # seconds between 2 checkpoints
+        'SPIDER_MIDDLEWARES': {'scraping.middlewares.WalkTrapMiddleware': 543},
+        'TRAP_CYCLE_LENGTH': 8, # jump when a walk visits again one of its 
+        # last TRAP_CYCLE_LENGTH pages
+        'TRAP_DOMAIN_PAGES': 10, # jump when a walk visited TRAP_DOMAIN_PAGES
+        # pages in a row in a domain, and less than TRAP_MIN_NOVELTY of them
+        # were saved
+        'TRAP_MIN_NOVELTY': 0.2,
+        'DOWNLOADER_MIDDLEWARES': {
+            'scraping.middlewares.AdaptiveThrottleMiddleware': 950},
+        'ADAPTIVE_THROTTLE_ENABLED': True, # per-domain concurrency and delay
+        'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': 8, # requests per domain
+        'ADAPTIVE_THROTTLE_TARGET_LATENCY': 2, # seconds
+        'ADAPTIVE_THROTTLE_MAX_DELAY': 30, # seconds
+        'VISITED_URLS_PATH': None, # file storing the visited URLs (see 
+        # URLStore). If None, a temporary file
+        'DEDUP_PATH': None, # prefix of the files storing the index of the 
+        # contents of the saved pages (see DuplicateFilter), to keep it between
+        # crawls. If None, temporary files
+        'DEDUP_SIMHASH_DISTANCE': None, # if not None, also skip the pages whose
+        # SimHash differs by at most this number of bits (ex: 3) from a saved 
+        # page
     }
     url_seeds = import_seeds(custom_settings['URL_SEEDS_LIST'], 
         custom_settings['URL_SEEDS_CSV_PATH'])
@@ -93,17 +150,114 @@ class RandomWalkSpider(scrapy.Spider):
         # URL_SEEDS_LIST or URL_SEEDS_CSV_PATH
     le = scrapy.linkextractors.LinkExtractor(canonicalize=True)
     # linkextractor is smarter than xpath '//a/@href'
-    visited_urls = [] # stores the visited URLs
 
-    def parse(self, response):
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        state_path = settings.get('WALK_STATE_PATH')
+        visited_path = settings.get('VISITED_URLS_PATH')
+        dedup_path = settings.get('DEDUP_PATH')
+        if state_path is not None:
+            # the visited URLs and the index of the contents must be kept
+            visited_path = visited_path or state_path + '.visited'
+            dedup_path = dedup_path or state_path + '.dedup'
+        # stores the visited URLs, with O(1) membership test and random 
+        # choice, and their strings on disk
+        spider.visited_urls = URLStore(visited_path)
+        # index of the contents of the saved pages
+        max_distance = settings.get('DEDUP_SIMHASH_DISTANCE')
+        if max_distance is not None:
+            max_distance = settings.getint('DEDUP_SIMHASH_DISTANCE')
+        spider.dedup = DuplicateFilter(dedup_path, max_distance)
+        spider.link_graph = None
+        if settings.get('LINK_GRAPH_PATH') is not None:
+            spider.link_graph = LinkGraph(settings.get('LINK_GRAPH_PATH'))
+        # URL requested by each walk
+        spider.walks = dict(enumerate(spider.start_urls))
+        spider.items_saved = 0
+        spider.walk_state = None
+        spider.snapshot = None # resumed, also by PageWriterPipeline
+        spider.sampler = None # set by PageWriterPipeline with RESERVOIR_SIZE
+        if state_path is not None:
+            spider.walk_state = WalkState(state_path)
+            snapshot = spider.snapshot = spider.walk_state.load()
+            if snapshot is not None:
+                spider.walks = snapshot['walks']
+                spider.items_saved = snapshot['items']
+                # CLOSESPIDER_ITEMCOUNT counts the pages saved by this run
+                remaining = (settings.getint('CLOSESPIDER_ITEMCOUNT') - 
+                    spider.items_saved)
+                if remaining <= 0:
+                    spider.walks = {} # the crawl is complete
+                # with the priority of the count, which can be set by -s
+                settings.set('CLOSESPIDER_ITEMCOUNT', max(remaining, 0), 
+                    priority=settings.getpriority('CLOSESPIDER_ITEMCOUNT'))
+                spider.logger.info('Resuming %d walks after %d saved pages '
+                    'and %d visited URLs' % (len(spider.walks), 
+                    spider.items_saved, len(spider.visited_urls)))
+        crawler.signals.connect(spider.item_scraped, 
+            signal=signals.item_scraped)
+        crawler.signals.connect(spider.spider_opened, 
+            signal=signals.spider_opened)
+        return spider
+
+    async def start(self):
+        for walk, url in list(self.walks.items()):
+            yield self.next_request(walk, url)
+
+    def next_request(self, walk, url):
+        """ Returns the request of the next page of the walk (an int), and 
+        records it as the current page of the walk """
+        self.walks[walk] = url
+        return scrapy.Request(url, callback=self.parse, 
+            errback=self.errback_httpbin, meta={'walk': walk})
+
+    def random_jump(self, walk):
+        """ Returns the request of a random jump of the walk """
+        return self.next_request(walk, random_jump_url(self.url_seeds, 
+            self.visited_urls))
+
+    def file_path(self, url):
+        """ Returns the path of the file of the page url """
+        return (self.settings.get('FILES_STORE') + 
+            sha1(url.encode()).hexdigest())
+
+    def item_scraped(self, item, response, spider):
+        self.items_saved += 1
+
+    def spider_opened(self, spider):
+        self.checkpoint_loop = None
+        if self.walk_state is not None:
+            self.checkpoint_loop = LoopingCall(self.checkpoint)
+            self.checkpoint_loop.start(
+                self.settings.getfloat('WALK_STATE_INTERVAL'), now=False)
+
+    def checkpoint(self):
+        """ Saves the state of the walk (see WalkState) """
+        if self.link_graph is not None:
+            self.link_graph.flush()
+        self.walk_state.save(self.walks, self.items_saved, 
+            len(self.visited_urls), self.sampler)
+        self.crawler.stats.inc_value('walk_state/checkpoints')
+
+    def closed(self, reason):
+        if self.walk_state is not None:
+            if self.checkpoint_loop is not None:
+                self.checkpoint_loop.stop()
+            self.checkpoint()
+        if self.link_graph is not None:
+            self.link_graph.close()
+
+    async def parse(self, response):
+        walk = response.meta.get('walk', 0)
         if not isinstance(response, scrapy.http.HtmlResponse): # not a HTML page
             # Choose at random an HTML page already visited or a url_seeds (the 
             # initial seeds). Don't save the page.
             next_url = random_jump_url(self.url_seeds, self.visited_urls)
             self.logger.debug('Not an HTML response. Random jump. %s' 
                 % response.url)
-            yield response.follow(next_url, callback=self.parse, 
-                errback=self.errback_httpbin)
+            yield self.next_request(walk, next_url)
         else:
             d = self.settings.getfloat('D_PROBABILITY')
             random_jump = choice([0,1]) # Bernouilli random variable
@@ -111,38 +265,49 @@ class RandomWalkSpider(scrapy.Spider):
                 next_url = random_jump_url(self.url_seeds, self.visited_urls)
                 self.logger.debug('Random jump from %s to %s' 
                     % (response.url, next_url))
-                yield scrapy.Request(next_url, callback=self.parse, 
-                    errback=self.errback_httpbin)
+                yield self.next_request(walk, next_url)
             else:
-                if response.url not in self.visited_urls:
-                    # save file
-                    folder = self.settings.get('FILES_STORE')
-                    filename = sha1(response.url.encode()).hexdigest()
-                    with open(folder+filename, 'wb') as f:
-                        f.write(response.body)
-                    self.logger.debug('Saved file %s' % filename)
+                new_page = response.url not in self.visited_urls
+                # whether the page is saved (see WalkTrapMiddleware)
+                response.meta['novel'] = False
+                if new_page:
                     self.visited_urls.append(response.url)
-                    item = randomWalkItem()
-                    item['url'] = response.url
-                    item['file_path'] = folder+filename
-                    yield item
+                    value = None
+                    if self.dedup.simhashes is not None:
+                        # CPU-bound: not in the reactor thread
+                        value = await maybe_deferred_to_future(deferToThread(
+                            simhash, response.body))
+                    duplicate = self.dedup.is_duplicate(response.body, value)
+                    if duplicate is not None:
+                        # not saved, not counted in CLOSESPIDER_ITEMCOUNT
+                        self.crawler.stats.inc_value('dedup/' + duplicate)
+                        self.logger.debug('Duplicated page (%s): %s' 
+                            % (duplicate, response.url))
+                    else:
+                        # the file is saved by PageWriterPipeline
+                        item = randomWalkItem()
+                        item['url'] = response.url
+                        item['file_path'] = self.file_path(response.url)
+                        item['body'] = response.body
+                        response.meta['novel'] = True
+                        yield item
                 urls = self.le.extract_links(response)
                 urls = [link.url for link in urls if link.url != response.url] 
                 # remove links to the same page (used a lot for links to anchors)
+                if new_page and self.link_graph is not None:
+                    self.link_graph.add(response.url, urls)
                 if len(urls) == 0:
                     # random jump because the nade has not outlink
                     self.logger.debug('No link to follow. Random jump: %s' 
                         % response.url)
                     next_url = random_jump_url(self.url_seeds, 
                         self.visited_urls)
-                    yield scrapy.Request(next_url, callback=self.parse, 
-                        errback=self.errback_httpbin)
+                    yield self.next_request(walk, next_url)
                 else:
                     next_url = choice(urls)
                     self.logger.debug('Following one link of: %s'
                      % response.url)
-                    yield response.follow(next_url, callback=self.parse, 
-                        errback=self.errback_httpbin)               
+                    yield self.next_request(walk, next_url)
 
     def errback_httpbin(self, failure):
         # random jump in case of failure (including HTTP, DNSm and TimeOut 
@@ -150,5 +315,5 @@ class RandomWalkSpider(scrapy.Spider):
         self.logger.error(repr(failure))
         next_url = random_jump_url(self.url_seeds, self.visited_urls)
         self.logger.debug('HTTP error. Random jump to: %s' % next_url)
-        return scrapy.Request(next_url, callback=self.parse, 
-            errback=self.errback_httpbin)
+        return self.next_request(failure.request.meta.get('walk', 0), 
+            next_url)
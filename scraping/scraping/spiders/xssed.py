@@ -3,23 +3,62 @@ import scrapy
 import re
 
 from scraping.items import xssedItem
+from scraping.mirrorindex import MirrorIndex, mirror_id
+
+# With XSSED_INDEX_PATH, the crawl is incremental: the mirrors already crawled
+# (see MirrorIndex) are not requested again, so their files are not downloaded
+# again, and the archive (sorted from the newest mirror) is browsed until
+# XSSED_STOP_AFTER_KNOWN_PAGES pages in a row only list known mirrors.
 
 class XssedSpider(scrapy.Spider):
     name = 'xssed'
     allowed_domains = ['xssed.com']
     start_urls = ['http://www.xssed.com/archive']
     custom_settings = { # overrides settings.py option to use a dedicated folder
-        'FILES_STORE': 'html/xssed/',
-        'METAREFRESH_ENABLED': False # disable redirection based on meta refresh: some XSS payloads includes it.
+        'FILES_STORE': 'html/xssed/', # or 'pagestore://html/xssed/store/' to
+        # store the pages in a PageStore (see pagestore.py)
+        'METAREFRESH_ENABLED': False, # disable redirection based on meta refresh: some XSS payloads includes it.
+        'ITEM_PIPELINES': {'scraping.pipelines.PageStoreFilesPipeline': 1,
+            'scraping.pipelines.MirrorIndexPipeline': 300},
+        'XSSED_INDEX_PATH': None, # if not None, index of the crawled mirrors
+        # (ex: 'html/xssed/mirrors.index'), to only crawl the new ones
+        'XSSED_STOP_AFTER_KNOWN_PAGES': 1, # number of pages of the archive in
+        # a row without new mirror before stopping (incremental crawl)
     }
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.mirror_index = None
+        if crawler.settings.get('XSSED_INDEX_PATH') is not None:
+            spider.mirror_index = MirrorIndex(
+                crawler.settings.get('XSSED_INDEX_PATH'))
+            spider.logger.info('Incremental crawl: %d mirrors already '
+                'crawled' % len(spider.mirror_index))
+        spider.known_pages = 0 # pages in a row without new mirror
+        return spider
+
+    def closed(self, reason):
+        if self.mirror_index is not None:
+            self.mirror_index.close()
+
     def parse(self, response):
         #response.xpath("//th[@id='tableborder']/table[1]/tr[not(@id='legends')]").extract()
         list_pages = response.xpath("//a[./text()='mirror']/@href").extract() # pages to scrape
+        if self.mirror_index is not None:
+            new_pages = [page for page in list_pages
+                if mirror_id(page) not in self.mirror_index]
+            self.crawler.stats.inc_value('xssed/known_mirrors', 
+                len(list_pages) - len(new_pages))
+            if list_pages:
+                self.known_pages = 0 if new_pages else self.known_pages + 1
+            list_pages = new_pages
         for page in list_pages:
             yield response.follow(page, self.parse_detail)
         next_page = response.xpath("//a[./text()='>']/@href").extract_first() # next page of the list
-        if next_page is not None:
+        if self.known_pages >= self.settings.getint('XSSED_STOP_AFTER_KNOWN_PAGES'):
+            self.logger.info('Only known mirrors in the last %d pages of the archive. Stopping at %s' % (self.known_pages, response.url))
+        elif next_page is not None:
             yield response.follow(next_page, self.parse)
 
     def parse_detail(self, response):
@@ -47,5 +86,7 @@ class XssedSpider(scrapy.Spider):
                 item[i] = item[i].strip()
         if item['category'] not in ['XSS', 'Script Insertion']:
             self.logger.info('not saving this non-XSS item: %s (%s)', response.url, item['category']) # example: http://www.xssed.com/mirror/76616/
+            if self.mirror_index is not None:
+                self.mirror_index.add(item['id']) # not requested again
         else:
             yield item
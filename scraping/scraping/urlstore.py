@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import numpy as np
+from hashlib import sha1
+
+# Store of the URLs visited by the random walk (see spiders/randomwalk.py).
+# The walk checks if each response was already visited, and the random jumps
+# choose uniformly one of the visited URLs. With a list, the first operation
+# is O(n), and all the URLs are kept in memory as Python strings.
+# URLStore does both in O(1), with about 24 bytes of memory per URL:
+# - a hash table (open addressing, linear probing) of 64-bit fingerprints of
+#   the URLs, in a numpy array, at most half full
+# - the URLs are appended to a file, and the offset of each one is kept in a
+#   numpy array, to read the i-th URL with one pread
+
+def fingerprint(url):
+    """ Input a URL, output its 64-bit fingerprint (never 0, the value of the
+    empty slots of the hash table) """
+    return int.from_bytes(sha1(url.encode()).digest()[:8], 'little') or 1
+
+class URLStore(object):
+    """ Append-only set of URLs, with O(1) membership test and O(1) access to
+    the i-th URL (list-like API: len, in, [i], append). The URLs are stored in
+    the file path, one per line (a temporary file if path is None), so they
+    must not contain newlines (canonicalized URLs don't). If path already 
+    exists, the URLs that it contains are loaded. """
+
+    def __init__(self, path=None, capacity=1 << 16):
+        # power of 2, to compute the slots with a mask
+        capacity = 1 << max(capacity - 1, 1).bit_length()
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, 'a+b', buffering=0)
+        self.path = path
+        self.size = 0
+        self.end = 0 # size of the file
+        self.offsets = np.zeros(capacity + 1, dtype=np.uint64)
+        self.table = np.zeros(2 * capacity, dtype=np.uint64)
+        self.mask = len(self.table) - 1
+        if path is not None and os.path.getsize(path) > 0:
+            self.load()
+
+    def load(self):
+        """ Indexes the URLs already in the file """
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # last URL partially written
+                self.index(line[:-1].decode(), len(line))
+        # ignore a partially written URL
+        self.file.truncate(self.end)
+
+    def __len__(self):
+        return self.size
+
+    def slot(self, key):
+        """ Returns the slot of the hash table of fingerprint key: the slot
+        containing key, or the empty slot where it should be inserted """
+        i = key & self.mask
+        table = self.table
+        while table[i] != 0 and table[i] != key:
+            i = (i + 1) & self.mask
+        return i
+
+    def __contains__(self, url):
+        key = fingerprint(url)
+        return self.table[self.slot(key)] == key
+
+    def __getitem__(self, i):
+        if not -self.size <= i < self.size:
+            raise IndexError('URLStore index out of range')
+        if i < 0:
+            i += self.size
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return os.pread(self.file.fileno(), end - start - 1, start).decode()
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def append(self, url):
+        """ Adds url to the store, if it is not already in it """
+        if url in self:
+            return
+        line = url.encode() + b'\n'
+        os.pwrite(self.file.fileno(), line, self.end)
+        self.index(url, len(line))
+
+    def index(self, url, length):
+        """ Adds url, of length bytes in the file, to the hash table and to the
+        offsets """
+        if 2 * (self.size + 1) > len(self.table):
+            self.grow()
+        key = fingerprint(url)
+        self.table[self.slot(key)] = key
+        self.size += 1
+        self.end += length
+        self.offsets[self.size] = self.end
+
+    def grow(self):
+        """ Doubles the capacity of the hash table and of the offsets """
+        keys = self.table[self.table != 0]
+        self.table = np.zeros(2 * len(self.table), dtype=np.uint64)
+        self.mask = len(self.table) - 1
+        for key in keys.tolist():
+            self.table[self.slot(key)] = key
+        offsets = np.zeros(len(self.table) // 2 + 1, dtype=np.uint64)
+        offsets[:self.size + 1] = self.offsets[:self.size + 1]
+        self.offsets = offsets
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import random
+
+# Checkpoints of the random walk (see spiders/randomwalk.py), so that a crawl
+# killed after days resumes where it stopped, instead of restarting from new
+# seeds. With WALK_STATE_PATH = prefix:
+# - the visited URLs (prefix.visited, a URLStore) and the index of the
+#   contents of the saved pages (prefix.dedup.*, see DuplicateFilter) are
+#   append-only files, written as the walk goes: they are never rewritten
+# - prefix.json is a snapshot of the rest: the URL requested by each walk,
+#   the state of the random generator and the number of saved pages. With
+#   RESERVOIR_SIZE, it also contains the state of the ReservoirSampler of
+#   PageWriterPipeline (the paths of the sampled pages, see sampling.py). Its
+#   size only depends on the number of walks (and of sampled pages), so
+#   saving it every WALK_STATE_INTERVAL seconds doesn't pause the crawl as
+#   the visited set grows. It is replaced atomically.
+
+class WalkState(object):
+    """ Snapshot of the random walk, stored in path + '.json' """
+
+    def __init__(self, path):
+        self.path = path + '.json'
+
+    def load(self):
+        """ Returns the last snapshot, as a dict with the keys walks (walk
+        id -> URL), items (number of saved pages), visited (number of
+        visited URLs) and reservoir (state of the sampler, or None), and
+        restores the state of the random generator. Returns None if there is
+        no snapshot """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        version, internal, gauss = snapshot['random']
+        random.setstate((version, tuple(internal), gauss))
+        snapshot['walks'] = {int(walk): url for walk, url in
+            snapshot['walks'].items()}
+        snapshot.setdefault('reservoir', None)
+        return snapshot
+
+    def save(self, walks, items, visited, sampler=None):
+        """ Writes the snapshot of the walks (walk id -> URL being visited),
+        the number of saved pages (items), the number of visited URLs, the
+        state of the random generator, and the state of the ReservoirSampler
+        sampler (if not None) """
+        snapshot = {'time': time.time(), 'walks': walks, 'items': items,
+            'visited': visited, 'random': random.getstate(),
+            'reservoir': sampler.getstate() if sampler is not None else None}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+"""
+This script serves the feature extraction of generate_data.py over HTTP (TCP
+or Unix socket), to screen pages with a model without paying the start of
+the interpreter and the import of bs4, html5lib and esprima per page.
+Requests are micro-batched and dispatched to a pool of worker processes,
+each one holding a FeatureExtractor.
+
+Endpoints:
+- POST /extract: {"url": ..., "html": ...} returns {"features": [...]}, or
+  {"pages": [{"url": ..., "html": ...}, ...]} returns {"features": [[...], ...]}
+- GET /columns: the names of the features, in the order of the vectors
+- GET /metrics: number of requests, errors, latency percentiles, etc.
+
+When more than --max-pending pages are waiting, requests are rejected with
+503 (the client should retry later). Requests that take more than --timeout
+seconds are answered with 504.
+
+Example:
+python3 serve.py --workers 4 --port 8000
+curl -d '{"url": "http://a.com/?q=<script>", "html": "<b>hi</b>"}' \
+    localhost:8000/extract
+"""
+
+import argparse, asyncio, json, time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+import numpy as np
+from generate_data import PARSERS, Budget, FeatureExtractor
+
+# FeatureExtractor of the worker process, see init_worker
+extractor = None
+
+def init_worker(parser, js_cache_size, budget):
+    global extractor
+    extractor = FeatureExtractor(parser = parser,
+        js_cache_size = js_cache_size, budget = budget)
+
+def extract_batch(pages):
+    """
+    Input a list of (url, html) tuples, outputs the list of their feature
+    vectors. Runs in the worker processes.
+    """
+    return extractor.extract_many(pages).tolist()
+
+class HTTPError(Exception):
+    def __init__(self, status, message = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+class ScoringService(object):
+    """
+    Micro-batching of the pages to extract: pages are queued by extract, and
+    sent to the pool by batches of at most batch_size pages, after waiting at
+    most batch_wait seconds for the batch to fill. At most one batch per
+    worker is being processed, so the queue (of at most max_pending pages)
+    fills up when the workers are busy.
+    """
+    def __init__(self, executor, workers, batch_size = 16, batch_wait = 0.002,
+            max_pending = 1024, timeout = 10.):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.queue = asyncio.Queue(max_pending)
+        self.slots = asyncio.Semaphore(workers)
+        self.metrics = Counter()
+        # latencies of the last requests, in seconds
+        self.latencies = deque(maxlen=10000)
+
+    async def extract(self, pages):
+        """
+        Returns the feature vectors of pages, a list of (url, html) tuples
+        """
+        if self.queue.maxsize - self.queue.qsize() < len(pages):
+            self.metrics['rejected'] += 1
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'too many pending '
+                'pages, retry later')
+        loop = asyncio.get_running_loop()
+        futures = []
+        for page in pages:
+            future = loop.create_future()
+            self.queue.put_nowait((page, future))
+            futures.append(future)
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures),
+                self.timeout)
+        except asyncio.TimeoutError:
+            self.metrics['timeouts'] += 1
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT)
+
+    async def run(self):
+        """
+        Forms the batches and sends them to the pool, forever
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            # requests that timed out are not processed
+            batch = [(page, future) for page, future in batch
+                if not future.done()]
+            if batch:
+                await self.slots.acquire()
+                loop.create_task(self.process(batch))
+
+    async def process(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self.executor, extract_batch,
+                [page for page, _ in batch])
+        except Exception as e:
+            self.metrics['worker_errors'] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(HTTPError(
+                        HTTPStatus.INTERNAL_SERVER_ERROR, repr(e)))
+        else:
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+            self.metrics['batches'] += 1
+            self.metrics['pages'] += len(batch)
+        finally:
+            self.slots.release()
+
+    def report(self):
+        """
+        Returns the metrics as a dict, with the p50 and p99 latencies in ms
+        """
+        report = dict(self.metrics)
+        report['pending'] = self.queue.qsize()
+        if self.latencies:
+            p50, p99 = np.percentile(self.latencies, [50, 99])
+            report['latency_p50_ms'] = p50 * 1e3
+            report['latency_p99_ms'] = p99 * 1e3
+        if self.metrics['batches']:
+            report['mean_batch_size'] = (self.metrics['pages'] /
+                self.metrics['batches'])
+        return report
+
+def parse_pages(body):
+    """
+    Parses the JSON body of POST /extract, returns the list of (url, html)
+    tuples and whether a single page was sent
+    """
+    try:
+        request = json.loads(body)
+        if 'pages' in request:
+            pages = [(i['url'], i['html']) for i in request['pages']]
+            single = False
+        else:
+            pages = [(request['url'], request['html'])]
+            single = True
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'invalid request: {0}'.format(
+            e))
+    if not all(isinstance(url, str) and isinstance(html, str)
+            for url, html in pages):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'url and html must be strings')
+    return pages, single
+
+async def read_request(reader, max_body):
+    """
+    Reads an HTTP/1.1 request, returns (method, path, headers, body), or None
+    if the connection was closed
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST)
+    if length > max_body:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+def write_response(writer, status, content, keep_alive = True):
+    body = json.dumps(content).encode()
+    writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\n'
+        'Content-Length: {2}\r\nConnection: {3}\r\n\r\n'.format(
+        status.value, status.phrase, len(body),
+        'keep-alive' if keep_alive else 'close').encode('latin-1') + body)
+
+async def handle(service, columns, max_body, reader, writer):
+    """
+    Serves the requests of a connection (keep-alive)
+    """
+    try:
+        while True:
+            try:
+                request = await read_request(reader, max_body)
+            except HTTPError as e:
+                write_response(writer, e.status, {'error': str(e)}, False)
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            start = time.perf_counter()
+            try:
+                if method == 'POST' and path == '/extract':
+                    pages, single = parse_pages(body)
+                    vectors = await service.extract(pages)
+                    content = {'features': vectors[0] if single else vectors}
+                    service.latencies.append(time.perf_counter() - start)
+                    service.metrics['requests'] += 1
+                elif method == 'GET' and path == '/columns':
+                    content = columns
+                elif method == 'GET' and path == '/metrics':
+                    content = service.report()
+                else:
+                    raise HTTPError(HTTPStatus.NOT_FOUND)
+            except HTTPError as e:
+                service.metrics['errors'] += 1
+                write_response(writer, e.status, {'error': str(e)},
+                    keep_alive)
+            else:
+                write_response(writer, HTTPStatus.OK, content, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(args):
+    budget = Budget(args.max_html_bytes, args.max_seconds,
+        args.max_script_bytes, args.max_script_nodes)
+    if budget == Budget():
+        budget = None
+    columns = FeatureExtractor(js_cache_size = 0, budget = budget).columns
+    with ProcessPoolExecutor(args.workers, initializer = init_worker,
+            initargs = (args.parser, args.js_cache_size, budget)) as executor:
+        service = ScoringService(executor, args.workers, args.batch_size,
+            args.batch_wait / 1e3, args.max_pending, args.timeout)
+        batcher = asyncio.create_task(service.run())
+        client = lambda reader, writer: handle(service, columns,
+            args.max_body, reader, writer)
+        if args.unix is not None:
+            server = await asyncio.start_unix_server(client, args.unix)
+            print('[INFO] listening on {0}'.format(args.unix))
+        else:
+            server = await asyncio.start_server(client, args.host, args.port)
+            print('[INFO] listening on {0}:{1}'.format(args.host, args.port))
+        async with server:
+            await server.serve_forever()
+        batcher.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the feature '
+        'extraction of generate_data.py over HTTP')
+    parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+        help='port to listen on (default: 8000)')
+    parser.add_argument('--unix', default=None,
+        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of worker processes (default: 1)')
+    parser.add_argument('--batch-size', type=int, default=16,
+        help='maximum number of pages per batch (default: 16)')
+    parser.add_argument('--batch-wait', type=float, default=2.,
+        help='time to wait for a batch to fill, in ms (default: 2)')
+    parser.add_argument('--max-pending', type=int, default=1024,
+        help='maximum number of pages waiting for a worker, above which '
+        'requests are rejected with 503 (default: 1024)')
+    parser.add_argument('--timeout', type=float, default=10.,
+        help='maximum time to answer a request, in s (default: 10)')
+    parser.add_argument('--max-body', type=int, default=16 << 20,
+        help='maximum size of a request, in bytes (default: 16MiB)')
+    parser.add_argument('--parser', choices=PARSERS, default='html5lib',
+        help='HTML parser backend (default: html5lib)')
+    parser.add_argument('--js-cache-size', type=int, default=65536,
+        help='number of JS codes whose features are memoized in each worker '
+        '(default: 65536)')
+    budget = parser.add_argument_group('budget', 'Limits of the cost of '
+        'parsing a page (see generate_data.py). Vectors then end with the '
+        'degraded feature')
+    budget.add_argument('--max-html-bytes', type=int, default=None)
+    budget.add_argument('--max-seconds', type=float, default=None)
+    budget.add_argument('--max-script-bytes', type=int, default=None)
+    budget.add_argument('--max-script-nodes', type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
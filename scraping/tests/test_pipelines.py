@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+from twisted.internet import reactor # non-asyncio: the pipeline awaits Deferreds
+from twisted.internet.defer import Deferred, gatherResults
+from scraping.pipelines import PageWriterPipeline
+
+
+class Stats(object):
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1):
+        self.values[key] = self.values.get(key, 0) + count
+
+    def max_value(self, key, value):
+        self.values[key] = max(self.values.get(key, value), value)
+
+    def set_value(self, key, value):
+        self.values[key] = value
+
+
+class StepPageWriterPipeline(PageWriterPipeline):
+    """ Runs the writes and removals when step is called, one at a time, so
+    that the items wait for the semaphore """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def in_thread(self, function, *args):
+        deferred = Deferred()
+        self.calls.append((function, args, deferred))
+        return deferred
+
+    def step(self):
+        while self.calls:
+            function, args, deferred = self.calls.pop(0)
+            deferred.callback(function(*args))
+
+
+def test_reservoir_more_items_than_threads(tmp_path):
+    pipeline = StepPageWriterPipeline(Stats(), threads=1, max_pending=1,
+        fsync_interval=0, reservoir_size=2, reservoir_seed=0)
+    pipeline.open_spider()
+    items = [{'file_path': str(tmp_path / str(i)), 'body': b'page'} for i in
+        range(40)]
+    results = gatherResults([Deferred.fromCoroutine(
+        pipeline.process_item(item)) for item in items])
+    pipeline.step()
+    pipeline.pool.stop()
+    assert len(results.result) == len(items)
+    assert all('body' not in item for item in items)
+    assert pipeline.sampler.seen == len(items)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path)
+        for path in pipeline.sampler.sample)
+    assert not pipeline.writing and not pipeline.evict_after
+
+
+def test_reservoir_eviction_while_removing(tmp_path):
+    # the second page is evicted by the third while it waits for the removal
+    # of the first page, that it evicted
+    pipeline = StepPageWriterPipeline(Stats(), threads=1, max_pending=1,
+        fsync_interval=0, reservoir_size=1, reservoir_seed=2)
+    pipeline.open_spider()
+    items = [{'file_path': str(tmp_path / str(i)), 'body': b'page'} for i in
+        range(3)]
+    Deferred.fromCoroutine(pipeline.process_item(items[0]))
+    pipeline.step()
+    results = gatherResults([Deferred.fromCoroutine(
+        pipeline.process_item(item)) for item in items[1:]])
+    pipeline.step()
+    pipeline.pool.stop()
+    assert len(results.result) == 2
+    assert pipeline.sampler.sample == [str(tmp_path / '2')]
+    assert os.listdir(tmp_path) == ['2']
+    assert not pipeline.writing and not pipeline.evict_after